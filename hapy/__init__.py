@@ -1,2 +1,6 @@
 from hapy import Hapy
 from hapy import HapyException
+from hapy import HapyTimeout
+from hapy import tune_jobs
+from cdx import CdxIndexer
+from scheduler import Scheduler
@@ -0,0 +1,53 @@
+import gzip
+import io
+import itertools
+import zlib
+
+
+ACTION_KINDS = ('seeds', 'schedule', 'include', 'force', 'recover')
+CHUNK_SIZE = 64 * 1024
+
+
+def read_uris(path):
+    """Yields the non-blank lines of a URI list, gzipped or not."""
+    if path.endswith('.gz'):
+        fd = gzip.open(path, 'rb')
+    else:
+        fd = io.open(path, 'rb')
+    with fd:
+        for line in fd:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def batches(items, size):
+    """Splits `items` into lazy batches of at most `size` items.
+
+    Each batch must be consumed before asking for the next one.
+    """
+    items = iter(items)
+    while True:
+        first = next(items, None)
+        if first is None:
+            return
+        yield itertools.chain([first], itertools.islice(items, size - 1))
+
+
+def gzip_lines(lines, level=6):
+    """Yields a gzip stream of `lines`, one line per URI, chunk by chunk."""
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    parts = []
+    size = 0
+    for line in lines:
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        parts.append(line.rstrip(b'\r\n') + b'\n')
+        size += len(parts[-1])
+        if size >= CHUNK_SIZE:
+            data = c.compress(b''.join(parts))
+            parts = []
+            size = 0
+            if data:
+                yield data
+    yield c.compress(b''.join(parts)) + c.flush()
@@ -0,0 +1,438 @@
+import io
+import json
+import os
+import re
+import zlib
+
+from hapy import HapyException
+from hapy import requests
+
+
+CDX_HEADER = u' CDX N b a m s k r M S V g\n'
+CHUNK_SIZE = 64 * 1024
+HTTP_HEADER_LIMIT = 64 * 1024
+INDEXED_TYPES = ('response', 'revisit', 'resource')
+WARC_SUFFIXES = ('.warc', '.warc.gz')
+
+
+class CdxError(HapyException):
+
+    def __init__(self, errors):
+        Exception.__init__(self, 'CdxError: %s' % '; '.join(
+            '%s: %s' % (f, errors[f]) for f in sorted(errors)
+        ))
+        self.errors = errors
+
+
+class _ChunkReader(object):
+    """File-like view over an iterator of byte chunks.
+
+    Only the current chunk is held in memory; `pos` counts the bytes
+    consumed so far so callers can record offsets into the source.
+    """
+
+    def __init__(self, chunks, pos=0):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self.pos = pos
+
+    def read_chunk(self):
+        if self._buffer:
+            data, self._buffer = self._buffer, b''
+        else:
+            data = next(self._chunks, b'')
+        self.pos += len(data)
+        return data
+
+    def unread(self, data):
+        self._buffer = data + self._buffer
+        self.pos -= len(data)
+
+    def read(self, n):
+        parts = []
+        while n > 0:
+            data = self.read_chunk()
+            if not data:
+                break
+            if len(data) > n:
+                self.unread(data[n:])
+                data = data[:n]
+            parts.append(data)
+            n -= len(data)
+        return b''.join(parts)
+
+    def readline(self, limit=None):
+        parts = []
+        size = 0
+        while limit is None or size < limit:
+            data = self.read_chunk()
+            if not data:
+                break
+            end = data.find(b'\n')
+            if end != -1:
+                self.unread(data[end + 1:])
+                data = data[:end + 1]
+            parts.append(data)
+            size += len(data)
+            if end != -1:
+                break
+        return b''.join(parts)
+
+    def skip(self, n):
+        while n > 0:
+            data = self.read_chunk()
+            if not data:
+                return False
+            if len(data) > n:
+                self.unread(data[n:])
+                data = data[:n]
+            n -= len(data)
+        return True
+
+
+class _GzipMember(object):
+    """Decompressed chunks of the gzip member at the start of `source`.
+
+    `ended` is only set once the whole member, trailer included, has
+    been read; a member that is still being written never ends.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.ended = False
+
+    def __iter__(self):
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while True:
+            chunk = self.source.read_chunk()
+            if not chunk:
+                break
+            data = d.decompress(chunk)
+            if data:
+                yield data
+            if d.unused_data:
+                self.source.unread(d.unused_data)
+                self.ended = True
+                return
+        # Input past the end of a complete member is left over as unused
+        # data; an incomplete one swallows it (or fails the CRC check).
+        try:
+            d.decompress(b'\0')
+        except zlib.error:
+            return
+        self.ended = bool(d.unused_data)
+
+
+def _read_headers(reader, limit=None):
+    headers = {}
+    first = None
+    size = 0
+    while True:
+        line = reader.readline(limit)
+        size += len(line)
+        if not line.endswith(b'\n') or (limit is not None and size > limit):
+            return None, None
+        line = line.strip().decode('utf-8', 'replace')
+        if not line:
+            if first is None:
+                continue
+            return first, headers
+        if first is None:
+            first = line
+            continue
+        key, _, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+
+
+def _parse_record(reader):
+    version, headers = _read_headers(reader)
+    if version is None or not version.startswith('WARC/'):
+        return None
+    try:
+        length = int(headers['content-length'])
+    except (KeyError, ValueError):
+        return None
+    record = dict(
+        type=headers.get('warc-type'),
+        url=headers.get('warc-target-uri'),
+        date=headers.get('warc-date'),
+        digest=headers.get('warc-payload-digest'),
+        mime=headers.get('content-type'),
+        status=None,
+        redirect=None,
+    )
+    block_end = reader.pos + length
+    if (record['type'] == 'response' and
+            (record['mime'] or '').startswith('application/http')):
+        status, http = _read_headers(
+            reader, min(length, HTTP_HEADER_LIMIT)
+        )
+        record['mime'] = None
+        if status is not None:
+            parts = status.split()
+            if len(parts) > 1:
+                record['status'] = parts[1]
+            record['mime'] = http.get('content-type')
+            record['redirect'] = http.get('location')
+    elif record['type'] == 'revisit':
+        record['mime'] = 'warc/revisit'
+    remaining = block_end - reader.pos
+    if remaining < 0 or not reader.skip(remaining):
+        return None
+    # Each record block is followed by two CRLFs.
+    if len(reader.read(4)) != 4:
+        return None
+    return record
+
+
+def iter_records(chunks, offset=0, compressed=False):
+    """Yields the header fields of each complete WARC record in `chunks`.
+
+    `chunks` must start at `offset` in the WARC file. Record bodies are
+    skipped without being buffered. A trailing, partially written record
+    is not yielded.
+    """
+    source = _ChunkReader(chunks, offset)
+    while True:
+        start = source.pos
+        if compressed:
+            member = _GzipMember(source)
+            reader = _ChunkReader(member)
+            record = _parse_record(reader)
+            # Decompress through whatever is left of the member so that
+            # `source` ends up on the next member boundary.
+            if record is not None:
+                while reader.read_chunk():
+                    pass
+                if not member.ended:
+                    return
+        else:
+            record = _parse_record(source)
+        if record is None:
+            return
+        record['offset'] = start
+        record['length'] = source.pos - start
+        yield record
+
+
+def surt(url):
+    # Records like dns: lookups have no authority to reverse.
+    if re.match(r'^[a-z][a-z0-9+.-]*:(?!//|\d)', url, re.I):
+        return url.lower()
+    match = re.match(r'^(?:[a-z][a-z0-9+.-]*://)?([^/?#]*)(.*)$', url, re.I)
+    host, rest = match.group(1).lower(), match.group(2)
+    host = host.rsplit('@', 1)[-1]
+    host, _, port = host.partition(':')
+    if port in ('', '80', '443'):
+        port = ''
+    else:
+        port = ':' + port
+    parts = host.split('.')
+    if parts and parts[0] == 'www':
+        parts = parts[1:]
+    return '%s%s)%s' % (
+        ','.join(reversed(parts)), port, (rest or '/').lower()
+    )
+
+
+def cdx_line(record, filename):
+    date = re.sub(r'\D', '', record['date'] or '')[:14]
+    digest = record['digest'] or '-'
+    if ':' in digest:
+        digest = digest.split(':', 1)[1]
+    mime = (record['mime'] or '-').split(';')[0].strip() or '-'
+    fields = [
+        surt(record['url']),
+        date or '-',
+        record['url'],
+        mime,
+        record['status'] or '-',
+        digest,
+        record['redirect'] or '-',
+        '-',
+        str(record['length']),
+        str(record['offset']),
+        filename,
+    ]
+    return u' '.join(f.replace(' ', '%20') for f in fields) + u'\n'
+
+
+def _index_warc(task):
+    """Indexes one WARC from `task['offset']` on.
+
+    Runs in a worker process, so failures are returned as a message
+    rather than raised: the exception may not survive being pickled.
+    Returns `(filename, offset, cdx_bytes, count, received, error)`,
+    where `received` is the number of WARC bytes downloaded.
+    """
+    received = [0]
+    try:
+        return _index_warc_records(task, received) + (received[0], None)
+    except Exception as e:
+        return task['filename'], task['offset'], task['cdx_bytes'], 0, \
+            received[0], '%s: %s' % (e.__class__.__name__, e)
+
+
+def _counted(chunks, received):
+    for chunk in chunks:
+        received[0] += len(chunk)
+        yield chunk
+
+
+def _index_warc_records(task, received):
+    auth = task['auth']
+    if auth is not None:
+        auth = requests.auth.HTTPDigestAuth(*auth)
+    offset = task['offset']
+    cdx_bytes = task['cdx_bytes']
+    size = 0
+    if os.path.exists(task['cdx_path']):
+        size = os.path.getsize(task['cdx_path'])
+    if size < cdx_bytes:
+        # The CDX file has lost lines the state says it has, start over.
+        offset = cdx_bytes = 0
+    r = requests.get(
+        url=task['url'],
+        # Offsets refer to the file itself, so it must not be re-encoded.
+        headers={
+            'Range': 'bytes=%d-' % offset,
+            'Accept-Encoding': 'identity'
+        },
+        auth=auth,
+        verify=task['verify'],
+        timeout=task['timeout'],
+        stream=True
+    )
+    if r.status_code == 416:
+        return task['filename'], offset, cdx_bytes, 0
+    if r.status_code not in (200, 206):
+        raise HapyException(r)
+    chunks = _counted(
+        r.raw.stream(CHUNK_SIZE, decode_content=False), received
+    )
+    if r.status_code == 200 and offset:
+        # The server ignored the Range header, discard what we've seen.
+        reader = _ChunkReader(chunks)
+        if not reader.skip(offset):
+            return task['filename'], offset, cdx_bytes, 0
+        chunks = iter(reader.read_chunk, b'')
+    count = 0
+    with io.open(task['cdx_path'], 'ab') as fd:
+        # Drop lines written by a run that failed before saving its state,
+        # they are about to be indexed again.
+        fd.truncate(cdx_bytes)
+        if not cdx_bytes:
+            fd.write(CDX_HEADER.encode('utf-8'))
+        records = iter_records(
+            chunks, offset, task['filename'].endswith('.gz')
+        )
+        for record in records:
+            offset = record['offset'] + record['length']
+            if record['type'] not in INDEXED_TYPES or not record['url']:
+                continue
+            fd.write(cdx_line(record, task['filename']).encode('utf-8'))
+            count += 1
+    return (task['filename'], offset, os.path.getsize(task['cdx_path']),
+            count)
+
+
+class CdxIndexer(object):
+    """Incrementally builds CDX files for the WARCs a job has written.
+
+    One CDX file is written per WARC into `output_dir`. The byte offset
+    reached in each WARC, and the size of its CDX file at that point, are
+    kept in `state_path` so later runs only fetch (with a Range request)
+    and index records added since.
+    """
+
+    def __init__(self, hapy, name, output_dir, state_path=None,
+                 warc_path='latest/warcs/', processes=None,
+                 include_open=False):
+        self.hapy = hapy
+        self.name = name
+        self.output_dir = output_dir
+        if state_path is None:
+            state_path = os.path.join(output_dir, 'offsets.json')
+        self.state_path = state_path
+        self.warc_path = warc_path
+        self.processes = processes
+        self.include_open = include_open
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as fd:
+                return json.load(fd)
+        except IOError:
+            return {}
+
+    def save_state(self, state):
+        tmp = '%s.tmp' % self.state_path
+        with open(tmp, 'w') as fd:
+            json.dump(state, fd, indent=2, sort_keys=True)
+        os.rename(tmp, self.state_path)
+
+    def find_warcs(self):
+        warcs = []
+        for entry in self.hapy.list_job_directory(self.name, self.warc_path):
+            filename = entry
+            if self.include_open and filename.endswith('.open'):
+                filename = filename[:-len('.open')]
+            if filename.endswith(WARC_SUFFIXES):
+                warcs.append(entry)
+        return sorted(warcs)
+
+    def _tasks(self, state):
+        auth = self.hapy.auth
+        if auth is not None:
+            auth = (auth.username, auth.password)
+        base = '%s/job/%s/jobdir/%s' % (
+            self.hapy.base_url, self.name, self.warc_path
+        )
+        for entry in self.find_warcs():
+            filename = entry
+            if filename.endswith('.open'):
+                filename = filename[:-len('.open')]
+            saved = state.get(filename) or dict(offset=0, cdx_bytes=0)
+            yield dict(
+                url=base + entry,
+                filename=filename,
+                offset=saved['offset'],
+                cdx_bytes=saved['cdx_bytes'],
+                cdx_path=os.path.join(self.output_dir, '%s.cdx' % filename),
+                auth=auth,
+                verify=not self.hapy.insecure,
+                timeout=self.hapy.timeout
+            )
+
+    def run(self):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        state = self.load_state()
+        tasks = list(self._tasks(state))
+        counts = {}
+        errors = {}
+        if self.processes == 1 or len(tasks) <= 1:
+            results = map(_index_warc, tasks)
+            pool = None
+        else:
+            from multiprocessing import Pool
+            pool = Pool(self.processes)
+            results = pool.imap_unordered(_index_warc, tasks)
+        try:
+            for filename, offset, cdx_bytes, count, received, error in \
+                    results:
+                # WARCs are fetched without content encoding.
+                self.hapy._count(received, received)
+                if error is not None:
+                    errors[filename] = error
+                    continue
+                state[filename] = dict(offset=offset, cdx_bytes=cdx_bytes)
+                counts[filename] = count
+                self.save_state(state)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if errors:
+            raise CdxError(errors)
+        return counts
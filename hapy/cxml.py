@@ -0,0 +1,149 @@
+import re
+
+
+_TOKEN = re.compile(r'<!--.*?-->|<(/?)(bean|property)\b([^>]*?)(/?)>', re.S)
+
+
+def _attr(attrs, name):
+    match = re.search(r'\b%s\s*=\s*"([^"]*)"' % name, attrs)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def _escape(value):
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    value = u'%s' % (value,)
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '"', '&quot;')
+
+
+def _tags(cxml, pos=0):
+    for match in _TOKEN.finditer(cxml, pos):
+        if match.group(2) is not None:
+            yield match
+
+
+def _indent(cxml, pos):
+    start = cxml.rfind('\n', 0, pos) + 1
+    indent = cxml[start:pos]
+    if indent.strip():
+        return None
+    return indent
+
+
+def _find_bean(cxml, bean_id):
+    for tag in _tags(cxml):
+        if (tag.group(2) == 'bean' and not tag.group(1) and
+                _attr(tag.group(3), 'id') == bean_id):
+            return tag
+    raise ValueError('no bean with id %r in configuration' % bean_id)
+
+
+def _property_end(cxml, tag):
+    if tag.group(4):
+        return tag.end()
+    depth = 0
+    for other in _tags(cxml, tag.end()):
+        if other.group(2) != 'property' or other.group(4):
+            continue
+        if not other.group(1):
+            depth += 1
+        elif depth == 0:
+            return other.end()
+        else:
+            depth -= 1
+    raise ValueError('unclosed property %r' % _attr(tag.group(3), 'name'))
+
+
+def _set_property(cxml, bean_id, name, value):
+    element = u'<property name="%s" value="%s" />' % (name, _escape(value))
+    bean = _find_bean(cxml, bean_id)
+    if bean.group(4):
+        # <bean ... /> has no body yet, give it one.
+        indent = _indent(cxml, bean.start()) or ''
+        opening = cxml[bean.start():bean.end() - 2].rstrip() + '>'
+        return u'%s%s\n%s  %s\n%s</bean>%s' % (
+            cxml[:bean.start()], opening, indent, element, indent,
+            cxml[bean.end():]
+        )
+    depth = 0
+    for tag in _tags(cxml, bean.end()):
+        closing, kind, attrs, empty = tag.groups()
+        if kind == 'bean':
+            if empty:
+                continue
+            if not closing:
+                depth += 1
+                continue
+            if depth:
+                depth -= 1
+                continue
+            # Reached this bean's </bean> without finding the property.
+            indent = _indent(cxml, tag.start())
+            if indent is None:
+                return u'%s %s%s' % (
+                    cxml[:tag.start()], element, cxml[tag.start():]
+                )
+            line = tag.start() - len(indent)
+            inner = cxml.find('\n', bean.end()) + 1
+            inner_indent = None
+            if 0 < inner < line:
+                stripped = cxml[inner:line].lstrip(' \t')
+                inner_indent = cxml[inner:line - len(stripped)]
+            if not inner_indent:
+                inner_indent = indent + '  '
+            return u'%s%s%s\n%s' % (
+                cxml[:line], inner_indent, element, cxml[line:]
+            )
+        if depth or closing or _attr(attrs, 'name') != name:
+            continue
+        if empty and _attr(attrs, 'value') is not None:
+            token = re.sub(
+                r'(\bvalue\s*=\s*")[^"]*(")',
+                lambda m: m.group(1) + _escape(value) + m.group(2),
+                tag.group(0),
+                count=1
+            )
+            return cxml[:tag.start()] + token + cxml[tag.end():]
+        end = _property_end(cxml, tag)
+        return cxml[:tag.start()] + element + cxml[end:]
+    raise ValueError('unclosed bean %r' % bean_id)
+
+
+def _set_override(cxml, key, value):
+    # The simpleOverrides bean sets properties from a property list after
+    # the beans are built, so a key listed there has to be changed there.
+    try:
+        bean = _find_bean(cxml, 'simpleOverrides')
+    except ValueError:
+        return None
+    end = cxml.find('</bean>', bean.end())
+    pattern = re.compile(r'^([ \t]*)%s[ \t]*[=:].*$' % re.escape(key), re.M)
+    match = pattern.search(cxml, bean.end(), end)
+    if match is None:
+        return None
+    value = _escape(value).replace('\\', '\\\\').replace('\n', '\\n')
+    line = u'%s%s=%s' % (match.group(1), key, value)
+    return cxml[:match.start()] + line + cxml[match.end():]
+
+
+def patch_cxml(cxml, patches):
+    """Applies `{'beanId.property': value}` edits to a CXML document.
+
+    Edits are made in place on the text so comments, ordering and
+    formatting of the rest of the document survive. A key set in the
+    simpleOverrides property list is changed there; otherwise a property
+    that is missing (or only present in a comment) is added to its bean.
+    """
+    for key in sorted(patches):
+        bean_id, _, name = key.partition('.')
+        if not name:
+            raise ValueError('%r is not of the form bean.property' % key)
+        overridden = _set_override(cxml, key, patches[key])
+        if overridden is not None:
+            cxml = overridden
+            continue
+        cxml = _set_property(cxml, bean_id, name, patches[key])
+    return cxml
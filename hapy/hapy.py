@@ -1,19 +1,210 @@
-import os
+import importlib
+import pkgutil
+import re
+import threading
+import time
+import zlib
+
+from urllib import unquote
+from urlparse import urljoin
 
-from pkg_resources import resource_string
 from xml.etree import ElementTree
 
-import requests
+from actions import ACTION_KINDS
+from actions import batches
+from actions import gzip_lines
+from cxml import patch_cxml
+from reports import REPORTS
+from reports import parse_report
+
+
+class _LazyModule(object):
+    """Stand-in for a module that is only imported on first attribute access.
+
+    Keeps ``import hapy`` cheap for short-lived callers (CLI tools, cron
+    checks) that may never make an HTTP request.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+requests = _LazyModule('requests')
+
+
+def _load_script(name):
+    return pkgutil.get_data(__name__, 'scripts/%s' % name).decode('utf-8')
+
+
+def _groovy_literal(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, basestring):
+        value = value.replace('\\', '\\\\').replace("'", "\\'")
+        return "'%s'" % value
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(_groovy_literal(v) for v in value)
+    if isinstance(value, dict):
+        if not value:
+            return '[:]'
+        return '[%s]' % ', '.join(
+            '%s: %s' % (_groovy_literal(k), _groovy_literal(value[k]))
+            for k in sorted(value)
+        )
+    return str(value)
+
+
+def _values(value):
+    # __tree_to_dict collapses a single <value> child to a bare item.
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _totals(report):
+    return dict((k, int(v)) for k, v in (report or {}).items())
+
+
+def _pool_map(func, items, max_workers):
+    """Maps `func` over `items` in a thread pool.
+
+    An item that fails gets its exception in place of a result, so one
+    bad job doesn't hide what happened to the others.
+    """
+    from multiprocessing.pool import ThreadPool
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return e
+
+    pool = ThreadPool(min(max_workers, len(items)))
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+
+
+def _unescape(value):
+    """Reverses the backslash escaping done by patch_beans.groovy."""
+    return re.sub(
+        r'\\(.)', lambda m: _ESCAPES.get(m.group(1), m.group(0)), value
+    )
+
+
+def _coerce(value, kind):
+    if value == 'null':
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return value
+
+
+# tune_job keyword -> (bean property it sets on the running job, type).
+TUNABLES = {
+    'threads': ('crawlController.maxToeThreads', int),
+    'delay_factor': ('disposition.delayFactor', float),
+    'min_delay_ms': ('disposition.minDelayMs', int),
+    'max_delay_ms': ('disposition.maxDelayMs', int),
+    'respect_crawl_delay_up_to_seconds':
+        ('disposition.respectCrawlDelayUpToSeconds', int),
+    'max_per_host_bandwidth':
+        ('disposition.maxPerHostBandwidthUsageKbSec', int),
+    'balance_replenish_amount': ('frontier.balanceReplenishAmount', int),
+    'queue_total_budget': ('frontier.queueTotalBudget', int),
+}
+
+
+def tune_jobs(jobs, max_workers=4, persist=False, **settings):
+    """Applies the same `Hapy.tune_job` settings to many jobs at once.
+
+    `jobs` is an iterable of `(hapy, name)` pairs, so jobs may live on
+    different engines. Returns `{(base_url, name): changes}`, with the
+    exception in place of `changes` for a job that failed.
+    """
+    jobs = list(jobs)
+    changes = _pool_map(
+        lambda job: job[0].tune_job(job[1], persist=persist, **settings),
+        jobs,
+        max_workers
+    )
+    return dict(
+        ((h.base_url, name), c) for (h, name), c in zip(jobs, changes)
+    )
+
+
+def _bundled_script(name, **variables):
+    lines = [
+        'def %s = %s' % (k, _groovy_literal(variables[k]))
+        for k in sorted(variables)
+    ]
+    lines.append(_load_script(name))
+    return '\n'.join(lines)
 
 
 HEADERS = {
     'accept': 'application/xml'
 }
+# Seconds to wait for a checkpoint before giving up. A failed checkpoint
+# never becomes valid, so waiting forever would hang the caller.
+CHECKPOINT_TIMEOUT = 600
+CHUNK_SIZE = 64 * 1024
+
+
+class _Decoder(object):
+    """Incremental gzip/deflate decoder for a response body.
+
+    Servers disagree about whether "deflate" means a zlib stream or a raw
+    deflate stream, so the first chunk decides which one is used.
+    """
+
+    def __init__(self, encoding):
+        self._detect = encoding == 'deflate'
+        if encoding in ('gzip', 'x-gzip'):
+            self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._d = zlib.decompressobj()
+
+    def decompress(self, data):
+        if self._detect:
+            self._detect = False
+            try:
+                return self._d.decompress(data)
+            except zlib.error:
+                self._d = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._d.decompress(data)
+
+    def flush(self):
+        return self._d.flush()
 
 
 class HapyException(Exception):
 
     def __init__(self, r):
+        if isinstance(r, basestring):
+            super(HapyException, self).__init__('HapyException: %s' % r)
+            self.status_code = None
+            return
+        self.status_code = r.status_code
         super(HapyException, self).__init__(
             ('HapyException: '
              'request(url=%s, method=%s, data=%s), '
@@ -24,9 +215,15 @@ class HapyException(Exception):
         )
 
 
+class HapyTimeout(HapyException):
+
+    def __init__(self, message):
+        Exception.__init__(self, 'HapyTimeout: %s' % message)
+
+
 class Hapy:
 
-    def __init__(self, base_url, username=None, password=None, insecure=True, timeout=None):
+    def __init__(self, base_url, username=None, password=None, insecure=True, timeout=None, compress=True):
         if base_url.endswith('/'):
             base_url = base_url[:-1]
         self.base_url = '%s/engine' % base_url
@@ -36,46 +233,137 @@ class Hapy:
             self.auth = None
         self.insecure = insecure
         self.timeout = timeout
-
-    def _http_post(self, url, data, code=200):
+        self.compress = compress
+        self.transfer_stats = dict(wire_bytes=0, decoded_bytes=0)
+        # Fleet helpers stream responses from several threads at once.
+        self._stats_lock = threading.Lock()
+
+    def _headers(self, headers=HEADERS):
+        # requests asks for gzip/deflate by default, opt out if disabled.
+        if self.compress:
+            return headers
+        headers = dict(headers)
+        headers['accept-encoding'] = 'identity'
+        return headers
+
+    def _http_post(self, url, data, code=200, stream=False):
+        kwargs = dict(stream=True) if stream else {}
         r = requests.post(
             url=url,
             data=data,
-            headers=HEADERS,
+            headers=self._headers(),
             auth=self.auth,
             verify=not self.insecure,
             allow_redirects=False,
-            timeout=self.timeout
+            timeout=self.timeout,
+            **kwargs
         )
         self.lastresponse = r
         if r.status_code != code:
             raise HapyException(r)
         return r
 
-    def _http_get(self, url, code=200):
+    def _http_get(self, url, code=200, headers=HEADERS, stream=False):
+        kwargs = dict(stream=True) if stream else {}
         r = requests.get(
             url=url,
-            headers=HEADERS,
+            headers=self._headers(headers),
             auth=self.auth,
             verify=not self.insecure,
-            timeout=self.timeout
+            timeout=self.timeout,
+            **kwargs
         )
         self.lastresponse = r
         if r.status_code != code:
             raise HapyException(r)
         return r
 
+    def _iter_content(self, r):
+        encoding = r.headers.get('content-encoding', '').lower()
+        decoder = None
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            decoder = _Decoder(encoding)
+        try:
+            for chunk in r.raw.stream(CHUNK_SIZE, decode_content=False):
+                wire = len(chunk)
+                if decoder is not None:
+                    chunk = decoder.decompress(chunk)
+                self._count(wire, len(chunk))
+                if chunk:
+                    yield chunk
+            if decoder is not None:
+                chunk = decoder.flush()
+                if chunk:
+                    self._count(0, len(chunk))
+                    yield chunk
+        finally:
+            r.close()
+
+    def _count(self, wire_bytes, decoded_bytes):
+        with self._stats_lock:
+            self.transfer_stats['wire_bytes'] += wire_bytes
+            self.transfer_stats['decoded_bytes'] += decoded_bytes
+
+    def _iter_lines(self, r):
+        pending = b''
+        for chunk in self._iter_content(r):
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b'\r')
+        if pending:
+            yield pending
+
+    def _parse_xml(self, r):
+        parser = ElementTree.XMLParser()
+        for chunk in self._iter_content(r):
+            parser.feed(chunk)
+        return parser.close()
+
     def _http_put(self, url, data, code=200):
         r = requests.put(
             url=url,
             data=data,
-            headers=HEADERS,
+            headers=self._headers(),
             auth=self.auth,
             verify=not self.insecure,
             timeout=self.timeout
         )
         self.lastresponse = r
-        if r.status_code != code:
+        codes = code if isinstance(code, tuple) else (code,)
+        if r.status_code not in codes:
+            raise HapyException(r)
+        return r
+
+    def _http_put_file(self, url, fd, code=200):
+        # requests' digest auth answers a 401 by re-sending the request
+        # itself, without rewinding a file body, so the upload would go
+        # out empty. Build the Authorization header here instead, and on
+        # a 401 take the new challenge, rewind and try once more.
+        for attempt in range(2):
+            headers = dict(self._headers())
+            if self.auth is not None and self.auth.chal:
+                headers['authorization'] = self.auth.build_digest_header(
+                    'PUT', url
+                )
+            fd.seek(0)
+            r = requests.put(
+                url=url,
+                data=fd,
+                headers=headers,
+                verify=not self.insecure,
+                timeout=self.timeout
+            )
+            self.lastresponse = r
+            challenge = r.headers.get('www-authenticate', '')
+            if (r.status_code != 401 or self.auth is None or attempt or
+                    not challenge.lower().startswith('digest ')):
+                break
+            self.auth.chal = requests.utils.parse_dict_header(
+                challenge[len('digest '):]
+            )
+        codes = code if isinstance(code, tuple) else (code,)
+        if r.status_code not in codes:
             raise HapyException(r)
         return r
 
@@ -108,12 +396,13 @@ class Hapy:
             code=303
         )
 
-    def launch_job(self, name):
+    def launch_job(self, name, checkpoint=None):
+        data = dict(action='launch')
+        if checkpoint is not None:
+            data['checkpoint'] = checkpoint
         self._http_post(
             url='%s/job/%s' % (self.base_url, name),
-            data=dict(
-                action='launch'
-            ),
+            data=data,
             code=303
         )
 
@@ -182,15 +471,7 @@ class Hapy:
         )
 
     def execute_script(self, name, engine, script):
-        r = self._http_post(
-            url='%s/job/%s/script' % (self.base_url, name),
-            data=dict(
-                engine=engine,
-                script=script
-            ),
-            code=200
-        )
-        tree = ElementTree.fromstring(r.content)
+        tree = self._script_tree(name, engine, script)
         raw = tree.find('rawOutput')
         if raw is not None:
             raw = raw.text
@@ -208,6 +489,83 @@ class Hapy:
             code=200
         )
 
+    def patch_configuration(self, name, patches):
+        info = self.get_job_info(name)
+        url = info['job']['primaryConfigUrl']
+        r = self._http_get(
+            url=url,
+            stream=True
+        )
+        cxml = b''.join(self._iter_content(r))
+        cxml = patch_cxml(cxml.decode('utf-8'), patches)
+        self._http_put(
+            url=url,
+            data=cxml.encode('utf-8'),
+            code=200
+        )
+
+    def patch_running_configuration(self, name, patches):
+        changes = {}
+        lines = self._run_script(
+            name, 'patch_beans.groovy', patches=dict(patches)
+        )
+        for line in lines:
+            key, before, after = line.split('\t')
+            changes[key] = (_unescape(before), _unescape(after))
+        return changes
+
+    def tune_job(self, name, threads=None, delay_factor=None,
+                 min_delay_ms=None, max_delay_ms=None,
+                 respect_crawl_delay_up_to_seconds=None,
+                 max_per_host_bandwidth=None, balance_replenish_amount=None,
+                 queue_total_budget=None, persist=False):
+        settings = dict(
+            threads=threads,
+            delay_factor=delay_factor,
+            min_delay_ms=min_delay_ms,
+            max_delay_ms=max_delay_ms,
+            respect_crawl_delay_up_to_seconds=(
+                respect_crawl_delay_up_to_seconds),
+            max_per_host_bandwidth=max_per_host_bandwidth,
+            balance_replenish_amount=balance_replenish_amount,
+            queue_total_budget=queue_total_budget,
+        )
+        settings = dict((k, v) for k, v in settings.items() if v is not None)
+        if not settings:
+            return {}
+        patches = {}
+        for key, value in settings.items():
+            prop, kind = TUNABLES[key]
+            patches[prop] = kind(value)
+        applied = self.patch_running_configuration(name, patches)
+        changes = {}
+        for key in settings:
+            prop, kind = TUNABLES[key]
+            if prop in applied:
+                before, after = applied[prop]
+                changes[key] = (_coerce(before, kind), _coerce(after, kind))
+        missing = sorted(set(settings) - set(changes))
+        if missing:
+            he = HapyException(
+                'settings not applied to job %s: %s' % (
+                    name, ', '.join(missing))
+            )
+            # The rest are already live; keep them so they can be undone.
+            he.changes = changes
+            raise he
+        if persist:
+            self.patch_configuration(name, patches)
+        return changes
+
+    def tune_jobs(self, names, max_workers=4, persist=False, **settings):
+        changes = tune_jobs(
+            [(self, name) for name in names],
+            max_workers=max_workers,
+            persist=persist,
+            **settings
+        )
+        return dict((name, c) for (_, name), c in changes.items())
+
     # End of documented API calls, here are some useful extras
 
     def __tree_to_dict(self, tree):
@@ -227,27 +585,284 @@ class Hapy:
         return {tree.tag: D}
 
     def get_info(self):
-        r = self._http_get(self.base_url)
-        return self.__tree_to_dict(ElementTree.fromstring(r.content))
+        r = self._http_get(self.base_url, stream=True)
+        return self.__tree_to_dict(self._parse_xml(r))
 
     def get_job_info(self, name):
-        r = self._http_get('%s/job/%s' % (self.base_url, name))
-        return self.__tree_to_dict(ElementTree.fromstring(r.content))
+        r = self._http_get('%s/job/%s' % (self.base_url, name), stream=True)
+        return self.__tree_to_dict(self._parse_xml(r))
 
     def get_job_configuration(self, name):
         info = self.get_job_info(name)
         url = info['job']['primaryConfigUrl']
         r = self._http_get(
-            url=url
+            url=url,
+            stream=True
+        )
+        return b''.join(self._iter_content(r))
+
+    def download_job_file(self, name, path, fd):
+        r = self._http_get(
+            url='%s/job/%s/jobdir/%s' % (self.base_url, name, path),
+            headers={'accept': '*/*'},
+            stream=True
+        )
+        for chunk in self._iter_content(r):
+            fd.write(chunk)
+
+    def wait_for_action(self, name, action, timeout=None, interval=1.0):
+        start = time.time()
+        while True:
+            info = self.get_job_info(name)
+            actions = info['job']['availableActions']
+            if actions and action in _values(actions.get('value')):
+                return info
+            if timeout is not None and time.time() - start > timeout:
+                raise HapyTimeout(
+                    'action %s not available for job %s after %ss' % (
+                        action, name, timeout
+                    )
+                )
+            time.sleep(interval)
+
+    def list_job_directory(self, name, path=''):
+        if path and not path.endswith('/'):
+            path += '/'
+        url = '%s/job/%s/jobdir/%s' % (self.base_url, name, path)
+        r = self._http_get(url, headers={'accept': 'text/html'}, stream=True)
+        text = b''.join(self._iter_content(r)).decode('utf-8', 'replace')
+        entries = []
+        for href in re.findall(r'href="([^"]+)"', text):
+            link = urljoin(url, href)
+            if not link.startswith(url) or re.search(r'[?#]', link):
+                continue
+            entry = unquote(link[len(url):])
+            if entry and '/' not in entry.rstrip('/') and entry not in entries:
+                entries.append(entry)
+        return entries
+
+    def get_report(self, name, report, live=False, numpy=False,
+                   path='latest/reports/'):
+        filename, report_class = REPORTS[report]
+        if live:
+            url = '%s/job/%s/report/%s' % (self.base_url, name, report_class)
+        else:
+            url = '%s/job/%s/jobdir/%s%s' % (
+                self.base_url, name, path, filename
+            )
+        r = self._http_get(url, headers={'accept': 'text/plain'}, stream=True)
+        return parse_report(self._iter_lines(r), numpy=numpy)
+
+    def get_action_directory(self, name, info=None):
+        if info is None:
+            info = self.get_job_info(name)
+        config_files = info['job'].get('configFiles') or {}
+        for value in _values(config_files.get('value')):
+            if value.get('key') == 'actionDirectory.actionDir':
+                return value['path'], value['url']
+        raise KeyError('job %s has no action directory' % name)
+
+    def _pending_action_files(self, name, url):
+        jobdir = '%s/job/%s/jobdir/' % (self.base_url, name)
+        path = url[len(jobdir):] if url.startswith(jobdir) else url
+        entries = self.list_job_directory(name, path)
+        return [e for e in entries if not e.endswith('/')]
+
+    def drop_action_file(self, name, filename, lines, action_path=None):
+        from tempfile import TemporaryFile
+        if action_path is None:
+            action_path = self.get_action_directory(name)[0]
+        staged = '%s.part' % filename
+        # Spool to disk rather than sending a generator, so the upload can
+        # be sent again if digest auth asks for it.
+        with TemporaryFile() as body:
+            for chunk in gzip_lines(lines):
+                body.write(chunk)
+            expected = body.tell()
+            self._http_put_file(
+                url='%s/job/%s/jobdir/%s' % (self.base_url, name, staged),
+                fd=body,
+                code=(200, 201, 204)
+            )
+        lines = self._run_script(
+            name, 'move_action_file.groovy',
+            staged=staged,
+            target='%s/%s' % (action_path.rstrip('/'), filename),
+            expected=expected
+        )
+        size, moved = lines[0].split('\t') if lines else (None, 'false')
+        if moved != 'true':
+            raise HapyException(
+                'could not move %s into the action directory '
+                '(staged %s bytes, sent %d)' % (staged, size, expected)
+            )
+
+    def import_uris(self, name, uris, kind='schedule', batch_size=100000,
+                    max_pending=2, wait=True, timeout=None, interval=1.0):
+        if kind not in ACTION_KINDS:
+            raise ValueError('unknown action file kind %r' % kind)
+        info = self.get_job_info(name)
+        action_path, action_url = self.get_action_directory(name, info)
+        before = _totals(info['job'].get('uriTotalsReport'))
+        start = time.time()
+        prefix = 'hapy-%d' % (start * 1000)
+
+        def wait_for(predicate, what):
+            started = time.time()
+            while True:
+                pending = self._pending_action_files(name, action_url)
+                if predicate(pending):
+                    return
+                if timeout is not None and time.time() - started > timeout:
+                    raise HapyTimeout(
+                        '%s for job %s after %ss' % (what, name, timeout)
+                    )
+                time.sleep(interval)
+
+        files = []
+        for i, batch in enumerate(batches(uris, batch_size)):
+            wait_for(
+                lambda pending: len(pending) < max_pending,
+                'action directory still full'
+            )
+            filename = '%s-%05d.%s.gz' % (prefix, i, kind)
+            self.drop_action_file(name, filename, batch, action_path)
+            files.append(filename)
+        result = dict(files=files, before=before, after=None)
+        if wait and files:
+            wait_for(
+                lambda pending: not set(files) & set(pending),
+                'action files not ingested'
+            )
+            info = self.get_job_info(name)
+            result['after'] = _totals(info['job'].get('uriTotalsReport'))
+        return result
+
+    def _script_tree(self, name, engine, script):
+        r = self._http_post(
+            url='%s/job/%s/script' % (self.base_url, name),
+            data=dict(
+                engine=engine,
+                script=script
+            ),
+            code=200,
+            stream=True
+        )
+        return self._parse_xml(r)
+
+    def _run_script(self, name, script, **variables):
+        tree = self._script_tree(
+            name, 'groovy', _bundled_script(script, **variables)
         )
-        return r.content
+        # The endpoint answers 200 even when the script throws, and
+        # reports the exception in the body instead.
+        exception = (tree.findtext('exception') or '').strip()
+        if exception or tree.findtext('failure') == 'true':
+            raise HapyException('%s failed on job %s: %s' % (
+                script, name, exception or 'unknown error'
+            ))
+        raw = tree.findtext('rawOutput')
+        if not raw:
+            return []
+        return raw.splitlines()
 
     def delete_job(self, name):
-        script = resource_string(__name__, 'scripts/delete_job.groovy')
-        self.execute_script(name, 'groovy', script)
-        info = self.get_info()
-        jdir = info['engine']['jobsDir']
-        jobpath = os.path.join(jdir, '%s.jobpath' % name)
-        if os.path.isfile(jobpath):
-            os.remove(jobpath)
-        self.rescan_job_directory()
+        result = self.delete_jobs([name])
+        if name not in result['deleted']:
+            reason = 'it is running' if name in result['running'] \
+                else 'no such job'
+            raise HapyException(
+                'could not delete job %s: %s' % (name, reason)
+            )
+
+    def delete_jobs(self, names):
+        names = list(names)
+        result = dict(deleted=[], running=[])
+        # The script has to run in the context of some job; if that job is
+        # already gone the endpoint 404s, so try the next one.
+        for context in names:
+            try:
+                lines = self._run_script(
+                    context, 'delete_jobs.groovy', names=names
+                )
+            except HapyException as he:
+                if he.status_code != 404:
+                    raise
+                continue
+            for line in lines:
+                status, name = line.split('\t', 1)
+                result[status].append(name)
+            break
+        return result
+
+    def list_checkpoints(self, name):
+        checkpoints = []
+        for line in self._run_script(name, 'list_checkpoints.groovy'):
+            cp_name, size, modified, valid = line.split('\t')
+            checkpoints.append(dict(
+                name=cp_name,
+                size=int(size),
+                modified=int(modified),
+                valid=(valid == 'true')
+            ))
+        return sorted(checkpoints, key=lambda cp: cp['name'])
+
+    def wait_for_checkpoint(self, name, known=(), timeout=CHECKPOINT_TIMEOUT,
+                            interval=1.0):
+        known = set(known)
+        start = time.time()
+        while True:
+            for cp in reversed(self.list_checkpoints(name)):
+                if cp['valid'] and cp['name'] not in known:
+                    return cp
+            if timeout is not None and time.time() - start > timeout:
+                raise HapyTimeout(
+                    'no new checkpoint for job %s after %ss' % (name, timeout)
+                )
+            time.sleep(interval)
+
+    def checkpoint_job_and_wait(self, name, timeout=CHECKPOINT_TIMEOUT,
+                                interval=1.0):
+        known = [cp['name'] for cp in self.list_checkpoints(name)]
+        self.checkpoint_job(name)
+        return self.wait_for_checkpoint(
+            name, known=known, timeout=timeout, interval=interval
+        )
+
+    def checkpoint_jobs(self, names, max_workers=2,
+                        timeout=CHECKPOINT_TIMEOUT, interval=1.0):
+        names = list(names)
+        checkpoints = _pool_map(
+            lambda n: self.checkpoint_job_and_wait(
+                n, timeout=timeout, interval=interval
+            ),
+            names,
+            max_workers
+        )
+        return dict(zip(names, checkpoints))
+
+    def prune_checkpoints(self, name, keep=1, older_than=None,
+                          dry_run=False):
+        if keep < 1:
+            raise ValueError('keep must be at least 1, got %r' % keep)
+        checkpoints = self.list_checkpoints(name)
+        valid = [cp for cp in checkpoints if cp['valid']]
+        retained = valid[-keep:]
+        if not retained:
+            return []
+        cutoff = retained[0]['name']
+        if older_than is not None:
+            # Heritrix reports modification times in milliseconds.
+            threshold = (time.time() - older_than) * 1000
+        doomed = []
+        for cp in checkpoints:
+            if cp['name'] >= cutoff:
+                break
+            if older_than is not None and cp['modified'] > threshold:
+                continue
+            doomed.append(cp['name'])
+        if dry_run or not doomed:
+            return doomed
+        return self._run_script(
+            name, 'delete_checkpoints.groovy', names=doomed
+        )
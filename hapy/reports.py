@@ -0,0 +1,64 @@
+import array
+import re
+
+
+REPORTS = {
+    'hosts': ('hosts-report.txt', 'HostsReport'),
+    'mimetype': ('mimetype-report.txt', 'MimetypesReport'),
+    'responsecode': ('responsecode-report.txt', 'ResponseCodeReport'),
+    'seeds': ('seeds-report.txt', 'SeedsReport'),
+}
+
+
+def _is_count(column):
+    return column.startswith('#')
+
+
+def parse_report(lines, numpy=False):
+    """Parses a Heritrix text report into a `dict` of columns.
+
+    The first line names the columns, e.g. `[#urls] [#bytes] [host]`.
+    Count columns (those starting with `#`) are stored as `array.array`
+    of longs, everything else as a list of strings. A count that isn't a
+    number (Heritrix writes `-` for unknown values) is stored as -1. A
+    count column holding a value too big for a C long, such as a byte
+    total above 2 GiB where longs are 32 bits, is stored as doubles
+    instead. The last column takes the rest of each line, so it may
+    contain spaces. With `numpy=True` every column is converted to a
+    NumPy array instead.
+    """
+    lines = iter(lines)
+    columns = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        columns = re.findall(r'\[([^\]]+)\]', line)
+        if columns:
+            break
+    data = [array.array('l') if _is_count(c) else [] for c in columns]
+    width = len(columns)
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        fields = line.split(None, width - 1)
+        if not fields:
+            continue
+        fields.extend([''] * (width - len(fields)))
+        for i, field in enumerate(fields):
+            column = data[i]
+            if isinstance(column, array.array):
+                try:
+                    field = int(field)
+                except ValueError:
+                    field = -1
+                try:
+                    column.append(field)
+                except OverflowError:
+                    data[i] = column = array.array('d', column)
+                    column.append(field)
+                continue
+            column.append(field)
+    if numpy:
+        import numpy as np
+        data = [np.array(column) for column in data]
+    return dict(zip(columns, data))
@@ -0,0 +1,182 @@
+import collections
+import time
+
+from hapy import HapyException
+from hapy import _values
+
+
+ACTIVE_STATES = (
+    'PREPARING', 'RUNNING', 'EMPTY', 'PAUSING', 'PAUSED', 'STOPPING'
+)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Scheduler(object):
+    """Places queued jobs on the least loaded of a pool of engines.
+
+    An engine is eligible for another job while its heap use is below
+    `max_heap_ratio` of its maximum heap and, if `max_jobs` is set, it
+    runs fewer than `max_jobs` jobs. A healthy crawl keeps nearly all of
+    its toe threads busy, so the busy share only breaks ties between
+    engines unless `max_thread_ratio` is given as a hard limit. Each
+    engine takes at most one job per `step`, and an engine that can't be
+    reached is skipped for that step. Finished jobs are torn down so
+    their engine can take new work.
+    """
+
+    def __init__(self, engines, max_heap_ratio=0.8, max_thread_ratio=None,
+                 max_jobs=None, unpause=True, timeout=None, interval=1.0):
+        self.engines = list(engines)
+        self.max_heap_ratio = max_heap_ratio
+        self.max_thread_ratio = max_thread_ratio
+        self.max_jobs = max_jobs
+        self.unpause = unpause
+        self.timeout = timeout
+        self.interval = interval
+        self.queue = collections.deque()
+        self.placed = {}
+        self.finished = []
+        self.failed = {}
+        self.unreachable = {}
+
+    def submit(self, name, cxml):
+        self.queue.append((name, cxml))
+
+    def engine_load(self, engine):
+        info = self.engines[engine].get_info()['engine']
+        heap = info.get('heapReport') or {}
+        jobs = (info.get('jobs') or {}).get('value')
+        load = dict(
+            engine=engine,
+            used_heap=_int(heap.get('usedBytes')),
+            max_heap=_int(heap.get('maxBytes')),
+            busy_threads=0,
+            total_threads=0,
+            jobs=0,
+        )
+        for job in _values(jobs):
+            if job.get('crawlControllerState') not in ACTIVE_STATES:
+                continue
+            load['jobs'] += 1
+            job_info = self.engines[engine].get_job_info(job['shortName'])
+            report = job_info['job'].get('loadReport') or {}
+            load['busy_threads'] += _int(report.get('busyThreads'))
+            load['total_threads'] += _int(report.get('totalThreads'))
+        return load
+
+    def is_eligible(self, load):
+        if load['max_heap'] and (
+                float(load['used_heap']) / load['max_heap'] >=
+                self.max_heap_ratio):
+            return False
+        if self.max_thread_ratio is not None and load['total_threads'] and (
+                float(load['busy_threads']) / load['total_threads'] >=
+                self.max_thread_ratio):
+            return False
+        if self.max_jobs is not None and load['jobs'] >= self.max_jobs:
+            return False
+        return True
+
+    def _score(self, load):
+        heap = 0.0
+        if load['max_heap']:
+            heap = float(load['used_heap']) / load['max_heap']
+        threads = 0.0
+        if load['total_threads']:
+            threads = float(load['busy_threads']) / load['total_threads']
+        return (load['jobs'], heap, threads)
+
+    def start_job(self, engine, name, cxml):
+        h = self.engines[engine]
+        h.create_job(name)
+        try:
+            h.submit_configuration(name, cxml)
+            h.wait_for_action(name, 'build', self.timeout, self.interval)
+            h.build_job(name)
+            h.wait_for_action(name, 'launch', self.timeout, self.interval)
+            h.launch_job(name)
+            if self.unpause:
+                h.wait_for_action(
+                    name, 'unpause', self.timeout, self.interval
+                )
+                h.unpause_job(name)
+        except Exception:
+            self.discard_job(engine, name)
+            raise
+
+    def discard_job(self, engine, name):
+        """Best effort removal of a job that was created but failed to
+        start, so it doesn't linger on the engine."""
+        h = self.engines[engine]
+        for cleanup in (h.terminate_job, h.teardown_job, h.delete_job):
+            try:
+                cleanup(name)
+            except Exception:
+                pass
+
+    def reclaim(self):
+        for name, engine in list(self.placed.items()):
+            h = self.engines[engine]
+            try:
+                info = h.get_job_info(name)['job']
+            except HapyException as he:
+                del self.placed[name]
+                self.failed[name] = he
+                continue
+            except Exception:
+                # The engine may only be unreachable for now.
+                continue
+            state = info.get('crawlControllerState')
+            if state in ACTIVE_STATES:
+                continue
+            del self.placed[name]
+            if state != 'FINISHED':
+                # Torn down from outside, or never got going.
+                self.failed[name] = HapyException(
+                    'job %s is no longer running (state %s)' % (name, state)
+                )
+                continue
+            h.teardown_job(name)
+            self.finished.append(name)
+
+    def place(self):
+        loads = []
+        self.unreachable = {}
+        for engine in range(len(self.engines)):
+            try:
+                loads.append(self.engine_load(engine))
+            except Exception as e:
+                self.unreachable[engine] = e
+        while self.queue:
+            eligible = [l for l in loads if self.is_eligible(l)]
+            if not eligible:
+                break
+            load = min(eligible, key=self._score)
+            # The engine's reports won't reflect a new job until it has
+            # warmed up, so give it at most one per round and measure it
+            # again on the next step.
+            loads.remove(load)
+            name, cxml = self.queue.popleft()
+            try:
+                self.start_job(load['engine'], name, cxml)
+            except Exception as e:
+                self.failed[name] = e
+                continue
+            self.placed[name] = load['engine']
+
+    def step(self):
+        self.reclaim()
+        self.place()
+
+    def run(self, poll_interval=30):
+        while True:
+            self.step()
+            if not self.queue and not self.placed:
+                return self.finished
+            time.sleep(poll_interval)
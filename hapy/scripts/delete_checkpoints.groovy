@@ -0,0 +1,13 @@
+// Expects `names` (a list of checkpoint names) to be defined above this
+// line. Deletes each named checkpoint directory of this job and prints
+// the name of every checkpoint it deleted.
+def dir = appCtx.getBean('checkpointService').getCheckpointsDir().getFile()
+names.each { name ->
+    def cp = new File(dir, name)
+    if (cp.getParentFile() != dir || !cp.isDirectory()) {
+        return
+    }
+    if (cp.deleteDir()) {
+        rawOut.println(name)
+    }
+}
@@ -1,8 +0,0 @@
-def delClos
-delClos = { it.eachDir( delClos );
-            it.eachFile {
-                it.delete()
-            }
-        it.delete()
-}
-delClos( job.jobDir )
\ No newline at end of file
@@ -0,0 +1,19 @@
+// Expects `names` (a list of job names) to be defined above this line.
+// Deletes each job's directory and .jobpath file, then rescans the jobs
+// directory once. Running jobs are left alone. Prints "deleted" or
+// "running" and the job name, separated by a tab, for each job found.
+def engine = scriptResource.getEngine()
+names.each { name ->
+    def cj = engine.getJobConfigs().get(name)
+    if (cj == null) {
+        return
+    }
+    if (cj.isRunning()) {
+        rawOut.println('running\t' + name)
+        return
+    }
+    cj.getJobDir().deleteDir()
+    new File(engine.getJobsDir(), name + '.jobpath').delete()
+    rawOut.println('deleted\t' + name)
+}
+engine.findJobConfigs()
@@ -0,0 +1,12 @@
+// Prints one line per checkpoint directory of this job:
+// name, total size in bytes, last modified (ms) and whether it is valid,
+// separated by tabs.
+def dir = appCtx.getBean('checkpointService').getCheckpointsDir().getFile()
+if (dir.isDirectory()) {
+    dir.eachDir { cp ->
+        def size = 0
+        cp.eachFileRecurse(groovy.io.FileType.FILES) { size += it.length() }
+        def valid = new File(cp, 'valid').exists()
+        rawOut.println([cp.name, size, cp.lastModified(), valid].join('\t'))
+    }
+}
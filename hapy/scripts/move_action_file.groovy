@@ -0,0 +1,16 @@
+// Expects `staged` (a file name in the job directory), `target` (the
+// path it should have in the action directory) and `expected` (the
+// number of bytes uploaded) to be defined above this line. Renaming
+// keeps Heritrix from picking up a half-uploaded file, and checking the
+// size keeps it from picking up a truncated one.
+def source = new File(job.getJobDir(), staged)
+def dest = new File(target)
+def size = source.exists() ? source.length() : -1
+def moved = false
+if (size == expected) {
+    dest.getParentFile().mkdirs()
+    moved = source.renameTo(dest)
+} else {
+    source.delete()
+}
+rawOut.println("${size}\t${moved}")
@@ -0,0 +1,20 @@
+// Expects `patches` (a map of 'beanId.property' to value) to be defined
+// above this line. Sets each property on the running job's beans and
+// prints the key, old value and new value separated by tabs. Backslashes,
+// tabs and line breaks in the values are backslash-escaped so each
+// change stays on one line.
+def escape = { value ->
+    String.valueOf(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+}
+patches.each { key, value ->
+    def path = key.split('\\.')
+    def target = appCtx.getBean(path[0])
+    for (int i = 1; i < path.length - 1; i++) {
+        target = target."${path[i]}"
+    }
+    def property = path[path.length - 1]
+    def before = target."$property"
+    target."$property" = value
+    rawOut.println([key, escape(before), escape(target."$property")].join('\t'))
+}
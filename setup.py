@@ -15,7 +15,7 @@ config = {
     'scripts': [],
     'name': 'hapy-heritrix',
     'package_data': {
-        'hapy': ['scripts/delete_job.groovy']
+        'hapy': ['scripts/*.groovy']
     },
 }
 
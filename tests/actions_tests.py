@@ -0,0 +1,53 @@
+import gzip
+import os
+import shutil
+import tempfile
+import zlib
+
+from nose.tools import (
+    assert_equals,
+    with_setup
+)
+
+from hapy.actions import (
+    batches,
+    gzip_lines,
+    read_uris
+)
+
+tmp = None
+
+
+def setup_tmp():
+    global tmp
+    tmp = tempfile.mkdtemp()
+
+
+def teardown_tmp():
+    shutil.rmtree(tmp)
+
+
+def test_batches():
+    result = [list(batch) for batch in batches(range(1, 8), 3)]
+    assert_equals([[1, 2, 3], [4, 5, 6], [7]], result)
+    assert_equals([], list(batches([], 3)))
+
+
+def test_gzip_lines():
+    lines = ['http://example.com/%d' % i for i in range(20000)]
+    chunks = list(gzip_lines(iter(lines)))
+    assert len(chunks) > 1
+    data = zlib.decompress(b''.join(chunks), 16 + zlib.MAX_WBITS)
+    assert_equals(('\n'.join(lines) + '\n').encode('utf-8'), data)
+
+
+@with_setup(setup_tmp, teardown_tmp)
+def test_read_uris():
+    plain = os.path.join(tmp, 'uris.txt')
+    with open(plain, 'wb') as fd:
+        fd.write(b'http://a/\n\nhttp://b/\r\n')
+    compressed = os.path.join(tmp, 'uris.txt.gz')
+    with gzip.open(compressed, 'wb') as fd:
+        fd.write(b'http://c/\n')
+    assert_equals([b'http://a/', b'http://b/'], list(read_uris(plain)))
+    assert_equals([b'http://c/'], list(read_uris(compressed)))
@@ -0,0 +1,257 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+
+from mock import (
+    patch,
+    Mock
+)
+from nose.tools import (
+    assert_equals,
+    with_setup
+)
+
+import hapy
+from hapy import cdx
+
+BASE_URL = 'https://localhost:8443'
+tmp = None
+
+
+def _record(warc_type, url, payload, http=True):
+    if http:
+        block = (
+            b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/html; charset=utf-8\r\n'
+            b'\r\n' + payload
+        )
+        content_type = b'application/http; msgtype=response'
+    else:
+        block = payload
+        content_type = b'text/plain'
+    headers = (
+        b'WARC/1.0\r\n'
+        b'WARC-Type: ' + warc_type + b'\r\n'
+        b'WARC-Target-URI: ' + url + b'\r\n'
+        b'WARC-Date: 2013-11-18T12:33:50Z\r\n'
+        b'WARC-Payload-Digest: sha1:ABCDEF\r\n'
+        b'Content-Type: ' + content_type + b'\r\n'
+        b'Content-Length: ' + str(len(block)).encode() + b'\r\n'
+        b'\r\n'
+    )
+    return headers + block + b'\r\n\r\n'
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as fd:
+        fd.write(data)
+    return buf.getvalue()
+
+
+RECORDS = [
+    _record(b'warcinfo', b'', b'software: heritrix', http=False),
+    _record(b'response', b'http://www.example.com/', b'<html>' * 100),
+    _record(b'request', b'http://www.example.com/', b'GET /', http=False),
+    _record(b'response', b'http://example.com/a b', b'body'),
+]
+
+
+def _chunks(data, size=7):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_iter_records():
+    data = b''.join(RECORDS)
+    records = list(cdx.iter_records(_chunks(data)))
+    assert_equals(4, len(records))
+    assert_equals(
+        [len(r) for r in RECORDS],
+        [r['length'] for r in records]
+    )
+    assert_equals(len(RECORDS[0]), records[1]['offset'])
+    assert_equals('200', records[1]['status'])
+    assert_equals('text/html; charset=utf-8', records[1]['mime'])
+
+
+def test_iter_records_compressed():
+    members = [_gzip(r) for r in RECORDS]
+    data = b''.join(members)
+    records = list(cdx.iter_records(_chunks(data, 5), compressed=True))
+    assert_equals([len(m) for m in members], [r['length'] for r in records])
+    assert_equals(
+        len(members[0]) + len(members[1]),
+        records[2]['offset']
+    )
+
+
+def test_iter_records_skips_partial_record():
+    data = b''.join(RECORDS)
+    records = list(cdx.iter_records(_chunks(data[:-10])))
+    assert_equals(3, len(records))
+
+
+def test_iter_records_from_offset():
+    offset = len(RECORDS[0]) + len(RECORDS[1])
+    data = b''.join(RECORDS)[offset:]
+    records = list(cdx.iter_records(_chunks(data), offset))
+    assert_equals([offset, offset + len(RECORDS[2])],
+                  [r['offset'] for r in records])
+
+
+def test_surt():
+    assert_equals('com,example)/a', cdx.surt('http://www.Example.com:80/A'))
+    assert_equals('com,example)/', cdx.surt('https://example.com'))
+
+
+def test_surt_without_authority():
+    assert_equals('dns:www.example.com', cdx.surt('dns:www.Example.com'))
+    assert_equals('com,example)/', cdx.surt('example.com'))
+    assert_equals('com,example:8080)/a', cdx.surt('example.com:8080/a'))
+
+
+def test_cdx_line():
+    record = dict(
+        url='http://example.com/a b',
+        date='2013-11-18T12:33:50Z',
+        digest='sha1:ABCDEF',
+        mime='text/html; charset=utf-8',
+        status='200',
+        redirect=None,
+        length=10,
+        offset=20,
+    )
+    assert_equals(
+        'com,example)/a%20b 20131118123350 http://example.com/a%20b '
+        'text/html 200 ABCDEF - - 10 20 test.warc.gz\n',
+        cdx.cdx_line(record, 'test.warc.gz')
+    )
+
+
+def setup_tmp():
+    global tmp
+    tmp = tempfile.mkdtemp()
+
+
+def teardown_tmp():
+    shutil.rmtree(tmp)
+
+
+def _response(data, status_code):
+    r = Mock()
+    r.status_code = status_code
+    r.request = Mock()
+    r.raw.stream.return_value = iter(_chunks(data))
+    return r
+
+
+@with_setup(setup_tmp, teardown_tmp)
+@patch('hapy.cdx.requests')
+def test_indexer_is_incremental(mock_requests):
+    h = hapy.Hapy(BASE_URL)
+    first = b''.join(RECORDS[:2])
+    second = b''.join(RECORDS[2:])
+    compressed = _gzip(RECORDS[1])
+    indexer = cdx.CdxIndexer(h, 'test', tmp, processes=1, include_open=True)
+    listing = ['a.warc', 'b.warc.gz.open', 'crawl.log']
+    with patch.object(h, 'list_job_directory', return_value=listing):
+        mock_requests.get.side_effect = [
+            _response(first, 206),
+            _response(compressed, 206),
+        ]
+        assert_equals({'a.warc': 1, 'b.warc.gz': 1}, indexer.run())
+        mock_requests.get.side_effect = [
+            _response(second, 206),
+            _response(b'', 416),
+        ]
+        assert_equals({'a.warc': 1, 'b.warc.gz': 0}, indexer.run())
+    assert_equals(
+        'bytes=%d-' % len(first),
+        mock_requests.get.call_args_list[2][1]['headers']['Range']
+    )
+    assert_equals(
+        'https://localhost:8443/engine/job/test/jobdir/latest/warcs/a.warc',
+        mock_requests.get.call_args_list[2][1]['url']
+    )
+    assert_equals(
+        len(first) + len(compressed) + len(second),
+        h.transfer_stats['wire_bytes']
+    )
+    state = indexer.load_state()
+    assert_equals(len(first) + len(second), state['a.warc']['offset'])
+    assert_equals(len(compressed), state['b.warc.gz']['offset'])
+    assert_equals(
+        os.path.getsize(os.path.join(tmp, 'a.warc.cdx')),
+        state['a.warc']['cdx_bytes']
+    )
+    with open(os.path.join(tmp, 'a.warc.cdx')) as fd:
+        lines = fd.read().splitlines()
+    assert_equals(cdx.CDX_HEADER.strip('\n'), lines[0])
+    assert_equals(3, len(lines))
+    assert lines[2].startswith('com,example)/a%20b ')
+
+
+def test_iter_records_skips_truncated_gzip_trailer():
+    members = [_gzip(r) for r in RECORDS[:2]]
+    data = b''.join(members)[:-4]
+    records = list(cdx.iter_records(_chunks(data, 5), compressed=True))
+    assert_equals(1, len(records))
+
+
+@with_setup(setup_tmp, teardown_tmp)
+@patch('hapy.cdx.requests')
+def test_indexer_does_not_duplicate_after_failure(mock_requests):
+    h = hapy.Hapy(BASE_URL)
+    data = b''.join(RECORDS)
+    indexer = cdx.CdxIndexer(h, 'test', tmp, processes=1)
+    broken = _response(b'', 206)
+    # Fail part way through the last record, after one line is written.
+    after = sum(len(r) for r in RECORDS[:3]) // 7 + 1
+    broken.raw.stream.return_value = _failing(_chunks(data), after)
+    with patch.object(h, 'list_job_directory', return_value=['a.warc']):
+        mock_requests.get.side_effect = [broken, _response(data, 206)]
+        try:
+            indexer.run()
+        except cdx.CdxError as e:
+            assert 'a.warc' in e.errors
+        else:
+            raise AssertionError('CdxError not raised')
+        assert_equals({}, indexer.load_state())
+        assert_equals({'a.warc': 2}, indexer.run())
+    with open(os.path.join(tmp, 'a.warc.cdx')) as fd:
+        lines = fd.read().splitlines()
+    assert_equals(3, len(lines))
+
+
+def _failing(chunks, after):
+    for chunk in chunks[:after]:
+        yield chunk
+    raise IOError('connection reset')
+
+
+@with_setup(setup_tmp, teardown_tmp)
+@patch('hapy.cdx.requests')
+def test_indexer_pool_reports_http_errors(mock_requests):
+    h = hapy.Hapy(BASE_URL)
+    indexer = cdx.CdxIndexer(h, 'test', tmp, processes=2)
+    mock_requests.get.return_value = _response(b'', 404)
+    listing = ['a.warc', 'b.warc']
+    with patch.object(h, 'list_job_directory', return_value=listing):
+        try:
+            indexer.run()
+        except hapy.HapyException as he:
+            assert_equals(['a.warc', 'b.warc'], sorted(he.errors))
+            assert 'code=404' in str(he)
+        else:
+            raise AssertionError('HapyException not raised')
+    assert_equals({}, indexer.load_state())
+
+
+def test_find_warcs_skips_open_files():
+    h = hapy.Hapy(BASE_URL)
+    indexer = cdx.CdxIndexer(h, 'test', 'unused')
+    listing = ['b.warc.gz', 'a.warc.gz.open', 'a.warc', 'crawl.log']
+    with patch.object(h, 'list_job_directory', return_value=listing):
+        assert_equals(['a.warc', 'b.warc.gz'], indexer.find_warcs())
@@ -0,0 +1,107 @@
+from pkg_resources import resource_string
+
+from nose.tools import (
+    raises,
+    assert_equals,
+    assert_in
+)
+
+from hapy.cxml import patch_cxml
+
+CXML = resource_string(
+    __name__,
+    'assets/test_get_job_configuration.xml'
+).decode('utf-8')
+
+
+def test_patch_adds_commented_out_property():
+    cxml = patch_cxml(CXML, {'crawlController.maxToeThreads': 50})
+    assert_in(
+        '  <!-- <property name="scratchDir" value="scratch" /> -->\n'
+        '  <property name="maxToeThreads" value="50" />\n'
+        ' </bean>',
+        cxml
+    )
+    assert_in('<!-- <property name="maxToeThreads" value="25" /> -->', cxml)
+    assert_equals(len(CXML.splitlines()) + 1, len(cxml.splitlines()))
+
+
+def test_patch_replaces_existing_value():
+    cxml = patch_cxml(CXML, {'disposition.minDelayMs': 100})
+    cxml = patch_cxml(cxml, {'disposition.minDelayMs': 200})
+    assert_equals(1, cxml.count('<property name="minDelayMs" value="200" />'))
+    assert_equals(-1, cxml.find('name="minDelayMs" value="100"'))
+
+
+def test_patch_ignores_nested_beans():
+    cxml = (
+        '<beans>\n'
+        ' <bean id="outer" class="Outer">\n'
+        '  <property name="inner">\n'
+        '   <bean class="Inner">\n'
+        '    <property name="size" value="1"/>\n'
+        '   </bean>\n'
+        '  </property>\n'
+        ' </bean>\n'
+        '</beans>\n'
+    )
+    patched = patch_cxml(cxml, {'outer.size': 2, 'outer.enabled': True})
+    assert_in('<property name="size" value="1"/>', patched)
+    assert_in(
+        '  <property name="enabled" value="true" />\n'
+        '  <property name="size" value="2" />\n'
+        ' </bean>\n</beans>',
+        patched
+    )
+
+
+def test_patch_replaces_element_property():
+    cxml = (
+        '<bean id="b" class="B">\n'
+        '  <property name="p">\n'
+        '    <value>old</value>\n'
+        '  </property>\n'
+        '</bean>'
+    )
+    assert_equals(
+        '<bean id="b" class="B">\n'
+        '  <property name="p" value="a &amp; &quot;b&quot;" />\n'
+        '</bean>',
+        patch_cxml(cxml, {'b.p': 'a & "b"'})
+    )
+
+
+def test_patch_self_closing_bean():
+    cxml = ' <bean id="b" class="B"/>\n'
+    assert_equals(
+        ' <bean id="b" class="B">\n'
+        '   <property name="p" value="1" />\n'
+        ' </bean>\n',
+        patch_cxml(cxml, {'b.p': 1})
+    )
+
+
+def test_patch_updates_simple_overrides():
+    url = 'https://example.com/contact?a=1&b=2'
+    cxml = patch_cxml(CXML, {'metadata.operatorContactUrl': url})
+    assert_in(
+        '\nmetadata.operatorContactUrl='
+        'https://example.com/contact?a=1&amp;b=2\n'
+        'metadata.jobName=test\n',
+        cxml
+    )
+    assert_in(
+        '<property name="operatorContactUrl" value="[see override above]"/>',
+        cxml
+    )
+    assert_equals(len(CXML.splitlines()), len(cxml.splitlines()))
+
+
+@raises(ValueError)
+def test_patch_unknown_bean():
+    patch_cxml(CXML, {'noSuchBean.value': 1})
+
+
+@raises(ValueError)
+def test_patch_bad_key():
+    patch_cxml(CXML, {'crawlController': 1})
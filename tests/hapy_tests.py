@@ -1,3 +1,11 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
 from pkg_resources import resource_string
 from xml.etree import ElementTree
 
@@ -10,15 +18,26 @@ from mock import (
 from nose.tools import (
     raises,
     assert_is_none,
-    assert_equals
+    assert_equals,
+    assert_in,
+    assert_not_in
 )
 
 import hapy
 
 BASE_URL = 'https://localhost:8443'
+IMPORT_BUDGET = 0.25  # seconds, for a cold `import hapy` in a fresh process
 h = None
 
 
+def _stream(r, encoding=None, size=7):
+    chunks = [r.content[i:i + size] for i in range(0, len(r.content), size)]
+    r.headers = {}
+    if encoding is not None:
+        r.headers['content-encoding'] = encoding
+    r.raw.stream.side_effect = lambda *args, **kwargs: iter(chunks)
+
+
 def setup():
     global h
     h = hapy.Hapy(BASE_URL)
@@ -378,6 +397,7 @@ def test_execute_script(mock_requests):
         __name__,
         'assets/test_execute_script.xml'
     )
+    _stream(r)
     r.request = Mock()
     mock_requests.post.return_value = r
     name = 'test_execute_script'
@@ -394,7 +414,8 @@ def test_execute_script(mock_requests):
         verify=False,
         headers={'accept': 'application/xml'},
         allow_redirects=False,
-        timeout=None
+        timeout=None,
+        stream=True
     )
     assert_is_none(raw)
     assert_is_none(html)
@@ -408,6 +429,7 @@ def test_execute_script_raw(mock_requests):
         __name__,
         'assets/test_execute_script_raw.xml'
     )
+    _stream(r)
     r.request = Mock()
     mock_requests.post.return_value = r
     name = 'test_execute_script'
@@ -424,7 +446,8 @@ def test_execute_script_raw(mock_requests):
         verify=False,
         headers={'accept': 'application/xml'},
         allow_redirects=False,
-        timeout=None
+        timeout=None,
+        stream=True
     )
     assert_equals("raw", raw)
     assert_is_none(html)
@@ -438,6 +461,7 @@ def test_execute_script_html(mock_requests):
         __name__,
         'assets/test_execute_script_html.xml'
     )
+    _stream(r)
     r.request = Mock()
     mock_requests.post.return_value = r
     name = 'test_execute_script'
@@ -454,7 +478,8 @@ def test_execute_script_html(mock_requests):
         verify=False,
         headers={'accept': 'application/xml'},
         allow_redirects=False,
-        timeout=None
+        timeout=None,
+        stream=True
     )
     assert_equals("html", html)
     assert_is_none(raw)
@@ -468,6 +493,7 @@ def test_execute_script_both(mock_requests):
         __name__,
         'assets/test_execute_script_both.xml'
     )
+    _stream(r)
     r.request = Mock()
     mock_requests.post.return_value = r
     name = 'test_execute_script'
@@ -484,7 +510,8 @@ def test_execute_script_both(mock_requests):
         verify=False,
         headers={'accept': 'application/xml'},
         allow_redirects=False,
-        timeout=None
+        timeout=None,
+        stream=True
     )
     assert_equals("raw", raw)
     assert_equals("html", html)
@@ -499,6 +526,7 @@ def test_submit_configuration(mock_requests):
         __name__,
         'assets/test_get_job_info.xml'
     )
+    _stream(r)
     mock_requests.get.return_value = r
     r = Mock()
     r.status_code = 200
@@ -545,6 +573,7 @@ def test_get_info(mock_requests):
         __name__,
         'assets/test_get_info.xml'
     )
+    _stream(r)
     r.request = Mock()
     mock_requests.get.return_value = r
     info = h.get_info()
@@ -553,7 +582,8 @@ def test_get_info(mock_requests):
         auth=None,
         verify=False,
         headers={'accept': 'application/xml'},
-        timeout=None
+        timeout=None,
+        stream=True
     )
     assert_equals('3.1.1', info['engine']['heritrixVersion'])
 
@@ -566,6 +596,7 @@ def test_get_job_info(mock_requests):
         __name__,
         'assets/test_get_job_info.xml'
     )
+    _stream(r)
     r.request = Mock()
     mock_requests.get.return_value = r
     name = 'test_get_job_info'
@@ -575,7 +606,8 @@ def test_get_job_info(mock_requests):
         auth=None,
         verify=False,
         headers={'accept': 'application/xml'},
-        timeout=None
+        timeout=None,
+        stream=True
     )
     assert_equals('test', info['job']['shortName'])
 
@@ -597,6 +629,7 @@ def test_get_job_configuration(mock_requests):
         r.status_code = 200
         r.request = Mock()
         r.content = cxml if ('cxml' in kwargs['url']) else xml
+        _stream(r)
         return r
 
     mock_requests.get.side_effect = side_effect
@@ -606,6 +639,868 @@ def test_get_job_configuration(mock_requests):
         auth=None,
         verify=False,
         headers={'accept': 'application/xml'},
-        timeout=None
+        timeout=None,
+        stream=True
     )
     assert_equals(cxml, config)
+
+
+def _import_hapy_in_subprocess():
+    code = (
+        'import sys, time\n'
+        't = time.time()\n'
+        'import hapy\n'
+        'elapsed = time.time() - t\n'
+        'print(elapsed)\n'
+        'print(\'requests\' in sys.modules)\n'
+        'print(\'pkg_resources\' in sys.modules)\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    elapsed, has_requests, has_pkg_resources = out.decode().split()
+    return float(elapsed), has_requests, has_pkg_resources
+
+
+def test_import_is_lazy():
+    _, has_requests, has_pkg_resources = _import_hapy_in_subprocess()
+    assert_equals('False', has_requests)
+    assert_equals('False', has_pkg_resources)
+
+
+def test_import_time_budget():
+    elapsed = min(_import_hapy_in_subprocess()[0] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET, (
+        'import hapy took %.3fs, budget is %.3fs' % (elapsed, IMPORT_BUDGET)
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_delete_job(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_delete_jobs.xml'
+    )
+    _stream(r)
+    mock_requests.post.return_value = r
+    name = 'job-a'
+    h.delete_job(name)
+    assert_equals(1, mock_requests.post.call_count)
+    assert_equals(0, mock_requests.get.call_count)
+    kwargs = mock_requests.post.call_args[1]
+    assert_equals(
+        'https://localhost:8443/engine/job/%s/script' % name,
+        kwargs['url']
+    )
+    script = kwargs['data']['script']
+    assert script.startswith("def names = ['job-a']\n")
+    assert script.endswith(
+        resource_string('hapy', 'scripts/delete_jobs.groovy').decode('utf-8')
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_script_failure(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_execute_script_failure.xml'
+    )
+    _stream(r)
+    mock_requests.post.return_value = r
+    try:
+        h.list_checkpoints('test')
+    except hapy.HapyException as he:
+        assert_in('list_checkpoints.groovy failed on job test', str(he))
+        assert_in('NullPointerException', str(he))
+    else:
+        raise AssertionError('HapyException not raised')
+
+
+@patch('hapy.hapy.requests')
+def test_delete_job_running(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_delete_jobs.xml'
+    )
+    _stream(r)
+    mock_requests.post.return_value = r
+    try:
+        h.delete_job('job-b')
+    except hapy.HapyException as he:
+        assert_in('running', str(he))
+    else:
+        raise AssertionError('HapyException not raised')
+
+
+@raises(hapy.HapyException)
+@patch('hapy.hapy.requests')
+def test_delete_job_missing(mock_requests):
+    r = Mock()
+    r.status_code = 404
+    r.request = Mock()
+    mock_requests.post.return_value = r
+    h.delete_job('gone')
+
+
+@patch('hapy.hapy.requests')
+def test_delete_jobs(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_delete_jobs.xml'
+    )
+    _stream(r)
+    mock_requests.post.return_value = r
+    result = h.delete_jobs(['job-a', 'job-b', "it's"])
+    assert_equals(dict(deleted=['job-a'], running=['job-b']), result)
+    assert_equals(1, mock_requests.post.call_count)
+    kwargs = mock_requests.post.call_args[1]
+    assert_equals(
+        'https://localhost:8443/engine/job/job-a/script',
+        kwargs['url']
+    )
+    assert kwargs['data']['script'].startswith(
+        "def names = ['job-a', 'job-b', 'it\\'s']\n"
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_delete_jobs_empty(mock_requests):
+    assert_equals(dict(deleted=[], running=[]), h.delete_jobs([]))
+    assert_equals(0, mock_requests.post.call_count)
+
+
+@patch('hapy.hapy.requests')
+def test_delete_jobs_first_job_missing(mock_requests):
+    missing = Mock()
+    missing.status_code = 404
+    missing.request = Mock()
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_delete_jobs.xml'
+    )
+    _stream(r)
+    mock_requests.post.side_effect = [missing, r]
+    result = h.delete_jobs(['gone', 'job-a', 'job-b'])
+    assert_equals(dict(deleted=['job-a'], running=['job-b']), result)
+    urls = [c[1]['url'] for c in mock_requests.post.call_args_list]
+    assert_equals(
+        ['https://localhost:8443/engine/job/gone/script',
+         'https://localhost:8443/engine/job/job-a/script'],
+        urls
+    )
+
+
+@raises(hapy.HapyException)
+@patch('hapy.hapy.requests')
+def test_delete_jobs_other_error(mock_requests):
+    r = Mock()
+    r.status_code = 500
+    r.request = Mock()
+    mock_requests.post.return_value = r
+    h.delete_jobs(['a', 'b'])
+
+
+@patch('hapy.hapy.requests')
+def test_launch_job_from_checkpoint(mock_requests):
+    r = Mock()
+    r.status_code = 303
+    r.request = Mock()
+    mock_requests.post.return_value = r
+    name = 'test_launch_job'
+    h.launch_job(name, checkpoint='cp00001-20131118123350')
+    mock_requests.post.assert_called_with(
+        url='https://localhost:8443/engine/job/%s' % name,
+        data=dict(
+            action='launch',
+            checkpoint='cp00001-20131118123350'
+        ),
+        auth=None,
+        verify=False,
+        headers={'accept': 'application/xml'},
+        allow_redirects=False,
+        timeout=None
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_list_checkpoints(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_list_checkpoints.xml'
+    )
+    _stream(r)
+    mock_requests.post.return_value = r
+    checkpoints = h.list_checkpoints('test_list_checkpoints')
+    assert_equals(
+        ['cp00001-20131118123350',
+         'cp00002-20131118130350',
+         'cp00003-20131118133350'],
+        [cp['name'] for cp in checkpoints]
+    )
+    assert_equals(2048, checkpoints[1]['size'])
+    assert_equals(1384779830000, checkpoints[1]['modified'])
+    assert_equals([True, True, False], [cp['valid'] for cp in checkpoints])
+
+
+def _checkpoints(*specs):
+    return [
+        dict(name=name, size=1, modified=modified, valid=valid)
+        for name, modified, valid in specs
+    ]
+
+
+def test_prune_checkpoints():
+    checkpoints = _checkpoints(
+        ('cp00001', 1000, True),
+        ('cp00002', 2000, False),
+        ('cp00003', 3000, True),
+        ('cp00004', 4000, True),
+        ('cp00005', 5000, False),
+    )
+    with patch.object(h, 'list_checkpoints', return_value=checkpoints):
+        with patch.object(h, '_run_script', return_value=['x']) as run:
+            assert_equals(['x'], h.prune_checkpoints('test', keep=2))
+    run.assert_called_with(
+        'test', 'delete_checkpoints.groovy', names=['cp00001', 'cp00002']
+    )
+
+
+def test_prune_checkpoints_dry_run_older_than():
+    checkpoints = _checkpoints(
+        ('cp00001', 1000, True),
+        ('cp00002', time.time() * 1000, True),
+        ('cp00003', time.time() * 1000, True),
+    )
+    with patch.object(h, 'list_checkpoints', return_value=checkpoints):
+        with patch.object(h, '_run_script') as run:
+            doomed = h.prune_checkpoints(
+                'test', keep=1, older_than=60, dry_run=True
+            )
+    assert_equals(['cp00001'], doomed)
+    assert_equals(0, run.call_count)
+
+
+def test_prune_checkpoints_keeps_everything_without_valid():
+    checkpoints = _checkpoints(('cp00001', 1000, False))
+    with patch.object(h, 'list_checkpoints', return_value=checkpoints):
+        assert_equals([], h.prune_checkpoints('test', keep=1))
+
+
+@raises(ValueError)
+def test_prune_checkpoints_keep_zero():
+    h.prune_checkpoints('test', keep=0)
+
+
+def test_checkpoint_timeout_is_finite():
+    with patch.object(h, 'list_checkpoints', return_value=[]):
+        with patch.object(h, 'checkpoint_job'):
+            with patch('hapy.hapy.time') as mock_time:
+                mock_time.time.side_effect = [0, 0, hapy.hapy.CHECKPOINT_TIMEOUT + 1]
+                try:
+                    h.checkpoint_job_and_wait('test')
+                except hapy.HapyTimeout:
+                    return
+    raise AssertionError('checkpoint_job_and_wait did not time out')
+
+
+@raises(hapy.HapyTimeout)
+def test_wait_for_checkpoint_timeout():
+    checkpoints = _checkpoints(('cp00001', 1000, True))
+    with patch.object(h, 'list_checkpoints', return_value=checkpoints):
+        h.wait_for_checkpoint(
+            'test', known=['cp00001'], timeout=0, interval=0
+        )
+
+
+def test_checkpoint_jobs():
+    names = ['job-%d' % i for i in range(5)]
+    state = dict(active=0, peak=0)
+    lock = threading.Lock()
+
+    def checkpoint(name, timeout=None, interval=None):
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        time.sleep(0.01)
+        with lock:
+            state['active'] -= 1
+        return dict(name='cp-%s' % name)
+
+    with patch.object(h, 'checkpoint_job_and_wait', side_effect=checkpoint):
+        result = h.checkpoint_jobs(names, max_workers=2)
+    assert_equals(dict((n, dict(name='cp-%s' % n)) for n in names), result)
+    assert state['peak'] <= 2
+
+
+def test_checkpoint_jobs_reports_each_job():
+    error = hapy.HapyTimeout('no checkpoint')
+
+    def checkpoint(name, timeout=None, interval=None):
+        if name == 'bad':
+            raise error
+        return dict(name='cp-%s' % name)
+
+    with patch.object(h, 'checkpoint_job_and_wait', side_effect=checkpoint):
+        result = h.checkpoint_jobs(['a', 'bad', 'b'])
+    assert_equals(
+        dict(a=dict(name='cp-a'), bad=error, b=dict(name='cp-b')), result
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_list_job_directory(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = (
+        b'<a href="../">..</a>'
+        b'<a href="?sort=size">size</a>'
+        b'<a href="a.warc.gz">a.warc.gz</a>'
+        b'<a href="sub/">sub/</a>'
+        b'<a href="https://localhost:8443/engine/job/test/jobdir/'
+        b'latest/warcs/b%20c.warc">b c.warc</a>'
+        b'<a href="sub/deeper.warc">deeper.warc</a>'
+    )
+    _stream(r)
+    mock_requests.get.return_value = r
+    entries = h.list_job_directory('test', 'latest/warcs')
+    mock_requests.get.assert_called_with(
+        url='https://localhost:8443/engine/job/test/jobdir/latest/warcs/',
+        auth=None,
+        verify=False,
+        headers={'accept': 'text/html'},
+        timeout=None,
+        stream=True
+    )
+    assert_equals(['a.warc.gz', 'sub/', 'b c.warc'], entries)
+
+
+@patch('hapy.hapy.requests')
+def test_patch_configuration(mock_requests):
+    name = 'test_patch_configuration'
+    cxml = resource_string(
+        __name__,
+        'assets/test_get_job_configuration.xml'
+    )
+    xml = resource_string(
+        __name__,
+        'assets/test_get_job_info.xml'
+    )
+
+    def side_effect(**kwargs):
+        r = Mock()
+        r.status_code = 200
+        r.request = Mock()
+        r.content = cxml if ('cxml' in kwargs['url']) else xml
+        _stream(r)
+        return r
+
+    mock_requests.get.side_effect = side_effect
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    mock_requests.put.return_value = r
+    h.patch_configuration(name, {'crawlController.maxToeThreads': 50})
+    assert_equals(2, mock_requests.get.call_count)
+    kwargs = mock_requests.put.call_args[1]
+    assert_equals(
+        'https://localhost:8443/engine/job/test/jobdir/crawler-beans.cxml',
+        kwargs['url']
+    )
+    assert b'<property name="maxToeThreads" value="50" />' in kwargs['data']
+
+
+@patch('hapy.hapy.requests')
+def test_patch_running_configuration(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_patch_running_configuration.xml'
+    )
+    _stream(r)
+    mock_requests.post.return_value = r
+    changes = h.patch_running_configuration(
+        'test', {'crawlController.maxToeThreads': 50}
+    )
+    assert_equals({'crawlController.maxToeThreads': ('25', '50')}, changes)
+    script = mock_requests.post.call_args[1]['data']['script']
+    assert script.startswith(
+        "def patches = ['crawlController.maxToeThreads': 50]\n"
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_patch_running_configuration_escaped(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = resource_string(
+        __name__,
+        'assets/test_patch_running_configuration_escaped.xml'
+    )
+    _stream(r)
+    mock_requests.post.return_value = r
+    changes = h.patch_running_configuration('test', {'scope.rules': []})
+    assert_equals({'scope.rules': ('[a,\tb]\n[c]\\d', '[]')}, changes)
+
+
+def test_wait_for_action():
+    info = dict(job=dict(availableActions=dict(value='launch')))
+    with patch.object(h, 'get_job_info', return_value=info):
+        assert_equals(info, h.wait_for_action('test', 'launch'))
+
+
+@raises(hapy.HapyTimeout)
+def test_wait_for_action_timeout():
+    info = dict(job=dict(availableActions=None))
+    with patch.object(h, 'get_job_info', return_value=info):
+        h.wait_for_action('test', 'launch', timeout=0, interval=0)
+
+
+@patch('hapy.hapy.requests')
+def test_get_report(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = b'[#urls] [#bytes] [mime-types]\r\n5 1024 text/html\r\n'
+    _stream(r)
+    mock_requests.get.return_value = r
+    report = h.get_report('test', 'mimetype')
+    mock_requests.get.assert_called_with(
+        url=('https://localhost:8443/engine/job/test/jobdir/'
+             'latest/reports/mimetype-report.txt'),
+        auth=None,
+        verify=False,
+        headers={'accept': 'text/plain'},
+        timeout=None,
+        stream=True
+    )
+    assert_equals(['text/html'], report['mime-types'])
+    assert_equals([5], list(report['#urls']))
+    r.close.assert_called_with()
+
+
+@patch('hapy.hapy.requests')
+def test_get_report_live(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = b''
+    _stream(r)
+    mock_requests.get.return_value = r
+    h.get_report('test', 'hosts', live=True)
+    assert_equals(
+        'https://localhost:8443/engine/job/test/report/HostsReport',
+        mock_requests.get.call_args[1]['url']
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_get_job_info_gzip(mock_requests):
+    h = hapy.Hapy(BASE_URL)
+    xml = resource_string(
+        __name__,
+        'assets/test_get_job_info.xml'
+    )
+    d = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = d.compress(xml) + d.flush()
+    _stream(r, encoding='gzip')
+    mock_requests.get.return_value = r
+    info = h.get_job_info('test')
+    assert_equals('test', info['job']['shortName'])
+    assert_equals(len(r.content), h.transfer_stats['wire_bytes'])
+    assert_equals(len(xml), h.transfer_stats['decoded_bytes'])
+    r.raw.stream.assert_called_with(65536, decode_content=False)
+    r.close.assert_called_with()
+
+
+def test_transfer_stats_from_threads():
+    h = hapy.Hapy(BASE_URL)
+
+    def read():
+        r = Mock()
+        r.content = b'x' * 7000
+        _stream(r, size=1)
+        for _ in h._iter_content(r):
+            pass
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert_equals(
+        dict(wire_bytes=56000, decoded_bytes=56000), h.transfer_stats
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_raw_deflate(mock_requests):
+    d = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    r.content = d.compress(b'2013-11-18 log line\n' * 50) + d.flush()
+    _stream(r, encoding='deflate')
+    mock_requests.get.return_value = r
+    fd = io.BytesIO()
+    h.download_job_file('test', 'latest/logs/crawl.log', fd)
+    assert_equals(b'2013-11-18 log line\n' * 50, fd.getvalue())
+    mock_requests.get.assert_called_with(
+        url=('https://localhost:8443/engine/job/test/jobdir/'
+             'latest/logs/crawl.log'),
+        auth=None,
+        verify=False,
+        headers={'accept': '*/*'},
+        timeout=None,
+        stream=True
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_compression_disabled(mock_requests):
+    h = hapy.Hapy(BASE_URL, compress=False)
+    r = Mock()
+    r.status_code = 303
+    r.request = Mock()
+    mock_requests.post.return_value = r
+    h.build_job('test')
+    assert_equals(
+        {'accept': 'application/xml', 'accept-encoding': 'identity'},
+        mock_requests.post.call_args[1]['headers']
+    )
+
+
+def test_tune_job():
+    applied = {
+        'crawlController.maxToeThreads': ('25', '50'),
+        'disposition.delayFactor': ('5.0', '2.5'),
+    }
+    with patch.object(h, 'patch_running_configuration',
+                      return_value=applied) as live:
+        with patch.object(h, 'patch_configuration') as persisted:
+            changes = h.tune_job('test', threads=50, delay_factor=2.5)
+    live.assert_called_with('test', {
+        'crawlController.maxToeThreads': 50,
+        'disposition.delayFactor': 2.5,
+    })
+    assert_equals(0, persisted.call_count)
+    assert_equals(
+        dict(threads=(25, 50), delay_factor=(5.0, 2.5)),
+        changes
+    )
+
+
+def test_tune_job_persist():
+    applied = {'disposition.minDelayMs': ('null', '100')}
+    with patch.object(h, 'patch_running_configuration',
+                      return_value=applied):
+        with patch.object(h, 'patch_configuration') as persisted:
+            changes = h.tune_job('test', min_delay_ms=100, persist=True)
+    persisted.assert_called_with('test', {'disposition.minDelayMs': 100})
+    assert_equals(dict(min_delay_ms=(None, 100)), changes)
+
+
+def test_tune_job_types():
+    applied = {'disposition.delayFactor': ('5', '2.0')}
+    with patch.object(h, 'patch_running_configuration',
+                      return_value=applied) as live:
+        changes = h.tune_job('test', delay_factor=2)
+    live.assert_called_with('test', {'disposition.delayFactor': 2.0})
+    assert_equals(dict(delay_factor=(5.0, 2.0)), changes)
+    assert isinstance(changes['delay_factor'][1], float)
+
+
+def test_tune_job_not_applied():
+    applied = {'crawlController.maxToeThreads': ('25', '50')}
+    with patch.object(h, 'patch_running_configuration',
+                      return_value=applied):
+        with patch.object(h, 'patch_configuration') as persisted:
+            try:
+                h.tune_job('test', threads=50, queue_total_budget=10,
+                           persist=True)
+            except hapy.HapyException as he:
+                assert_in('queue_total_budget', str(he))
+                assert_not_in('threads', str(he))
+                assert_equals(dict(threads=(25, 50)), he.changes)
+            else:
+                raise AssertionError('HapyException not raised')
+    assert_equals(0, persisted.call_count)
+
+
+def test_tune_job_nothing():
+    with patch.object(h, 'patch_running_configuration') as live:
+        assert_equals({}, h.tune_job('test'))
+    assert_equals(0, live.call_count)
+
+
+def test_tune_jobs_keeps_going_after_a_failure():
+    h1 = hapy.Hapy('https://one:8443')
+    h2 = hapy.Hapy('https://two:8443')
+    error = hapy.HapyException('engine down')
+
+    def tune(self, name, **settings):
+        if self is h1:
+            raise error
+        return dict(threads=(25, 10))
+
+    with patch.object(hapy.Hapy, 'tune_job', autospec=True,
+                      side_effect=tune):
+        changes = hapy.tune_jobs([(h1, 'a'), (h2, 'b')], threads=10)
+    assert_equals(
+        {
+            ('https://one:8443/engine', 'a'): error,
+            ('https://two:8443/engine', 'b'): dict(threads=(25, 10)),
+        },
+        changes
+    )
+
+
+def test_tune_jobs_across_engines():
+    h1 = hapy.Hapy('https://one:8443')
+    h2 = hapy.Hapy('https://two:8443')
+    applied = {'crawlController.maxToeThreads': ('25', '10')}
+    with patch.object(hapy.Hapy, 'patch_running_configuration',
+                      return_value=applied):
+        changes = hapy.tune_jobs([(h1, 'a'), (h2, 'a'), (h2, 'b')],
+                                 threads=10)
+    assert_equals(
+        {
+            ('https://one:8443/engine', 'a'): dict(threads=(25, 10)),
+            ('https://two:8443/engine', 'a'): dict(threads=(25, 10)),
+            ('https://two:8443/engine', 'b'): dict(threads=(25, 10)),
+        },
+        changes
+    )
+    with patch.object(hapy.Hapy, 'patch_running_configuration',
+                      return_value=applied):
+        assert_equals(
+            {'a': dict(threads=(25, 10)), 'b': dict(threads=(25, 10))},
+            h2.tune_jobs(['a', 'b'], threads=10)
+        )
+
+
+def test_get_action_directory():
+    info = h._Hapy__tree_to_dict(ElementTree.fromstring(resource_string(
+        __name__,
+        'assets/test_get_job_info.xml'
+    )))
+    assert_equals(
+        ('/usr/local/heritrix-3.1.1/jobs/test/action',
+         'https://localhost:8443/engine/job/test/jobdir/action'),
+        h.get_action_directory('test', info)
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_drop_action_file(mock_requests):
+    r = Mock()
+    r.status_code = 201
+    r.request = Mock()
+    sent = []
+
+    def put(**kwargs):
+        sent.append(kwargs['data'].read())
+        return r
+
+    mock_requests.put.side_effect = put
+    with patch.object(h, '_run_script') as run:
+        run.side_effect = lambda *args, **kwargs: [
+            '%d\ttrue' % kwargs['expected']
+        ]
+        h.drop_action_file(
+            'test', 'a.schedule.gz', ['http://a/'], '/jobs/test/action'
+        )
+    kwargs = mock_requests.put.call_args[1]
+    assert_equals(
+        'https://localhost:8443/engine/job/test/jobdir/a.schedule.gz.part',
+        kwargs['url']
+    )
+    assert_equals(
+        b'http://a/\n',
+        zlib.decompress(sent[0], 16 + zlib.MAX_WBITS)
+    )
+    run.assert_called_with(
+        'test', 'move_action_file.groovy',
+        staged='a.schedule.gz.part',
+        target='/jobs/test/action/a.schedule.gz',
+        expected=len(sent[0])
+    )
+
+
+@patch('hapy.hapy.requests')
+def test_drop_action_file_digest_retry(mock_requests):
+    mock_requests.utils.parse_dict_header = requests.utils.parse_dict_header
+    h = hapy.Hapy(BASE_URL, username='admin', password='admin')
+    h.auth.chal = {}
+    stale = Mock()
+    stale.status_code = 401
+    stale.headers = {'www-authenticate': 'Digest realm="x", nonce="new"'}
+    ok = Mock()
+    ok.status_code = 201
+    ok.headers = {}
+    responses = [stale, ok]
+    sent = []
+
+    def put(**kwargs):
+        sent.append((kwargs['data'].read(), kwargs['headers'].copy()))
+        assert 'auth' not in kwargs
+        return responses.pop(0)
+
+    mock_requests.put.side_effect = put
+    with patch.object(h, '_run_script') as run:
+        run.side_effect = lambda *args, **kwargs: [
+            '%d\ttrue' % kwargs['expected']
+        ]
+        h.drop_action_file('test', 'a.seeds.gz', ['http://a/'], '/action')
+    assert_equals(2, len(sent))
+    assert sent[0][0] and sent[0][0] == sent[1][0]
+    assert_not_in('authorization', sent[0][1])
+    assert_equals(dict(realm='x', nonce='new'), h.auth.chal)
+    h.auth.build_digest_header.assert_called_once_with(
+        'PUT',
+        'https://localhost:8443/engine/job/test/jobdir/a.seeds.gz.part'
+    )
+    assert_equals(
+        h.auth.build_digest_header.return_value,
+        sent[1][1]['authorization']
+    )
+    assert_not_in('authorization', hapy.hapy.HEADERS)
+
+
+@raises(hapy.HapyException)
+@patch('hapy.hapy.requests')
+def test_drop_action_file_not_moved(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    mock_requests.put.return_value = r
+    with patch.object(h, '_run_script', return_value=[]):
+        h.drop_action_file('test', 'a.seeds.gz', ['http://a/'], '/action')
+
+
+@raises(hapy.HapyException)
+@patch('hapy.hapy.requests')
+def test_drop_action_file_size_mismatch(mock_requests):
+    r = Mock()
+    r.status_code = 200
+    r.request = Mock()
+    mock_requests.put.return_value = r
+    with patch.object(h, '_run_script', return_value=['0\tfalse']):
+        h.drop_action_file('test', 'a.seeds.gz', ['http://a/'], '/action')
+
+
+def test_import_uris():
+    h = hapy.Hapy(BASE_URL)
+    info = dict(job=dict(
+        configFiles=dict(value=dict(
+            key='actionDirectory.actionDir',
+            path='/jobs/test/action',
+            url='https://localhost:8443/engine/job/test/jobdir/action'
+        )),
+        uriTotalsReport=dict(totalUriCount='10', queuedUriCount='5')
+    ))
+    after = dict(job=dict(
+        uriTotalsReport=dict(totalUriCount='15', queuedUriCount='10')
+    ))
+    dropped = []
+    listings = []
+
+    def drop(name, filename, lines, action_path):
+        dropped.append((filename, list(lines), action_path))
+
+    def listing(name, path):
+        listings.append(path)
+        # First check for space finds a full directory, later ones don't.
+        if len(listings) == 1:
+            return ['x.schedule.gz', 'y.schedule.gz', 'done/']
+        return ['done/']
+
+    uris = ['http://example.com/%d' % i for i in range(5)]
+    with patch.object(h, 'get_job_info', side_effect=[info, after]):
+        with patch.object(h, 'drop_action_file', side_effect=drop):
+            with patch.object(h, 'list_job_directory', side_effect=listing):
+                result = h.import_uris(
+                    'test', iter(uris), batch_size=2, interval=0
+                )
+    assert_equals(['action'] * 5, listings)
+    assert_equals([uris[0:2], uris[2:4], uris[4:]],
+                  [lines for _, lines, _ in dropped])
+    assert_equals(
+        ['/jobs/test/action'] * 3,
+        [path for _, _, path in dropped]
+    )
+    assert_equals([f for f, _, _ in dropped], result['files'])
+    assert result['files'][0].endswith('-00000.schedule.gz')
+    assert_equals(dict(totalUriCount=10, queuedUriCount=5), result['before'])
+    assert_equals(dict(totalUriCount=15, queuedUriCount=10), result['after'])
+
+
+@raises(hapy.HapyTimeout)
+def test_import_uris_timeout():
+    h = hapy.Hapy(BASE_URL)
+    info = dict(job=dict(configFiles=dict(value=dict(
+        key='actionDirectory.actionDir',
+        path='/jobs/test/action',
+        url='https://localhost:8443/engine/job/test/jobdir/action'
+    ))))
+    with patch.object(h, 'get_job_info', return_value=info):
+        with patch.object(h, 'list_job_directory',
+                          return_value=['a.seeds.gz', 'b.seeds.gz']):
+            h.import_uris('test', ['http://a/'], kind='seeds', timeout=0,
+                          interval=0)
+
+
+def test_import_uris_timeout_is_per_wait():
+    h = hapy.Hapy(BASE_URL)
+    info = dict(job=dict(configFiles=dict(value=dict(
+        key='actionDirectory.actionDir',
+        path='/jobs/test/action',
+        url='https://localhost:8443/engine/job/test/jobdir/action'
+    ))))
+    clock = [0]
+    listings = [[], ['hapy-0-00000.seeds.gz'], []]
+
+    def drop(*args):
+        clock[0] += 10
+
+    def sleep(seconds):
+        clock[0] += 1
+
+    with patch('hapy.hapy.time') as mock_time:
+        mock_time.time.side_effect = lambda: clock[0]
+        mock_time.sleep.side_effect = sleep
+        with patch.object(h, 'get_job_info', return_value=info):
+            with patch.object(h, 'drop_action_file', side_effect=drop):
+                with patch.object(h, 'list_job_directory',
+                                  side_effect=lambda *a: listings.pop(0)):
+                    result = h.import_uris('test', ['http://a/'],
+                                           kind='seeds', timeout=5)
+    assert_equals(['hapy-0-00000.seeds.gz'], result['files'])
+
+
+@raises(ValueError)
+def test_import_uris_bad_kind():
+    h.import_uris('test', ['http://a/'], kind='bogus')
@@ -0,0 +1,65 @@
+import array
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equals
+
+from hapy.reports import parse_report
+
+HOSTS = [
+    b'[#urls] [#bytes] [host] [#robots] [#remaining]',
+    b'10 2048 example.com 0 5',
+    b'3 100 dns: 0 0',
+    b'',
+    b'1 - example.org 0 0',
+]
+
+SEEDS = [
+    b'[code] [status] [seed] [redirect]',
+    b'200 CRAWLED http://example.com/',
+    b'-6 NOTCRAWLED http://bad.example/ ',
+]
+
+
+def test_parse_hosts_report():
+    report = parse_report(HOSTS)
+    assert_equals(
+        sorted(['#urls', '#bytes', 'host', '#robots', '#remaining']),
+        sorted(report)
+    )
+    assert isinstance(report['#urls'], array.array)
+    assert_equals([10, 3, 1], list(report['#urls']))
+    assert_equals([2048, 100, -1], list(report['#bytes']))
+    assert_equals(['example.com', 'dns:', 'example.org'], report['host'])
+    assert_equals(14, sum(report['#urls']))
+
+
+def test_parse_report_overflow():
+    big = 2 ** 64
+    report = parse_report(HOSTS[:2] + [b'1 %d big.example 0 0' % big])
+    assert_equals('d', report['#bytes'].typecode)
+    assert_equals([2048.0, float(big)], list(report['#bytes']))
+    assert_equals('l', report['#urls'].typecode)
+
+
+def test_parse_seeds_report():
+    report = parse_report(SEEDS)
+    assert_equals(['200', '-6'], report['code'])
+    assert_equals(['', ''], report['redirect'])
+    assert_equals(
+        ['http://example.com/', 'http://bad.example/'],
+        report['seed']
+    )
+
+
+def test_parse_empty_report():
+    assert_equals({}, parse_report([]))
+
+
+def test_parse_report_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise SkipTest('numpy is not installed')
+    report = parse_report(HOSTS, numpy=True)
+    assert isinstance(report['#urls'], numpy.ndarray)
+    assert_equals(14, report['#urls'].sum())
@@ -0,0 +1,148 @@
+from mock import Mock
+from nose.tools import (
+    assert_equals,
+    assert_false,
+    assert_true
+)
+
+from hapy import HapyException
+from hapy.scheduler import Scheduler
+
+
+def _engine(used=0, jobs=(), busy=0, total=0):
+    h = Mock()
+    h.get_info.return_value = dict(engine=dict(
+        heapReport=dict(usedBytes=str(used), maxBytes='1000'),
+        jobs=dict(value=[
+            dict(shortName=name, crawlControllerState=state)
+            for name, state in jobs
+        ]) if jobs else None
+    ))
+    h.get_job_info.return_value = dict(job=dict(
+        crawlControllerState='RUNNING',
+        loadReport=dict(busyThreads=str(busy), totalThreads=str(total))
+    ))
+    return h
+
+
+def test_engine_load():
+    h = _engine(used=500, jobs=[('a', 'RUNNING'), ('b', 'FINISHED')],
+                busy=10, total=25)
+    load = Scheduler([h]).engine_load(0)
+    assert_equals(
+        dict(engine=0, used_heap=500, max_heap=1000, busy_threads=10,
+             total_threads=25, jobs=1),
+        load
+    )
+    h.get_job_info.assert_called_once_with('a')
+
+
+def test_is_eligible():
+    s = Scheduler([], max_heap_ratio=0.8, max_thread_ratio=0.9, max_jobs=2)
+    load = dict(used_heap=100, max_heap=1000, busy_threads=5,
+                total_threads=25, jobs=1)
+    assert_true(s.is_eligible(load))
+    assert_false(s.is_eligible(dict(load, used_heap=900)))
+    assert_false(s.is_eligible(dict(load, busy_threads=25)))
+    assert_false(s.is_eligible(dict(load, jobs=2)))
+
+
+def test_place_spreads_jobs():
+    busy = _engine(used=100, jobs=[('x', 'RUNNING')], busy=1, total=25)
+    idle = _engine(used=200)
+    full = _engine(used=900)
+    s = Scheduler([busy, idle, full], max_jobs=1)
+    s.submit('a', 'cxml-a')
+    s.submit('b', 'cxml-b')
+    s.step()
+    assert_equals({'a': 1}, s.placed)
+    assert_equals(['b'], [name for name, _ in s.queue])
+    idle.create_job.assert_called_once_with('a')
+    idle.submit_configuration.assert_called_once_with('a', 'cxml-a')
+    idle.build_job.assert_called_once_with('a')
+    idle.launch_job.assert_called_once_with('a')
+    idle.unpause_job.assert_called_once_with('a')
+    assert_equals(0, full.create_job.call_count)
+
+
+def test_place_one_job_per_engine_per_step():
+    engines = [_engine(), _engine()]
+    s = Scheduler(engines)
+    for i in range(40):
+        s.submit('job-%d' % i, 'cxml')
+    s.step()
+    assert_equals({'job-0': 0, 'job-1': 1}, s.placed)
+    assert_equals(38, len(s.queue))
+
+
+def test_reclaim_finished_jobs():
+    h = _engine()
+    s = Scheduler([h])
+    s.placed['a'] = 0
+    h.get_job_info.return_value = dict(job=dict(
+        crawlControllerState='FINISHED'
+    ))
+    assert_equals(['a'], s.run(poll_interval=0))
+    h.teardown_job.assert_called_once_with('a')
+    assert_equals({}, s.placed)
+
+
+def test_failed_job_is_recorded():
+    h = _engine()
+    error = HapyException.__new__(HapyException)
+    h.create_job.side_effect = error
+    s = Scheduler([h])
+    s.submit('a', 'cxml')
+    s.step()
+    assert_equals({'a': error}, s.failed)
+    assert_equals({}, s.placed)
+    # The job was never created, so there is nothing of ours to remove.
+    assert_equals(0, h.delete_job.call_count)
+
+
+def test_unreachable_engine_is_skipped():
+    down = _engine()
+    down.get_info.side_effect = IOError('connection refused')
+    up = _engine()
+    s = Scheduler([down, up])
+    s.submit('a', 'cxml')
+    s.step()
+    assert_equals({'a': 1}, s.placed)
+    assert_equals([0], list(s.unreachable))
+
+
+def test_failed_start_is_cleaned_up():
+    h = _engine()
+    h.build_job.side_effect = IOError('connection reset')
+    s = Scheduler([h])
+    s.submit('a', 'cxml')
+    s.step()
+    assert_equals(['a'], list(s.failed))
+    h.teardown_job.assert_called_once_with('a')
+    h.delete_job.assert_called_once_with('a')
+
+
+def test_vanished_job_is_failed():
+    h = _engine()
+    s = Scheduler([h])
+    s.placed['a'] = 0
+    h.get_job_info.return_value = dict(job=dict())
+    assert_equals([], s.run(poll_interval=0))
+    assert_equals(['a'], list(s.failed))
+    assert_equals(0, h.teardown_job.call_count)
+
+
+def test_busy_threads_only_break_ties():
+    busy = _engine(used=100, busy=25, total=25)
+    quiet = _engine(used=100, busy=5, total=25)
+    busy.get_info.return_value['engine']['jobs'] = dict(
+        value=[dict(shortName='x', crawlControllerState='RUNNING')]
+    )
+    quiet.get_info.return_value['engine']['jobs'] = dict(
+        value=[dict(shortName='y', crawlControllerState='RUNNING')]
+    )
+    s = Scheduler([busy, quiet])
+    assert_true(s.is_eligible(s.engine_load(0)))
+    s.submit('a', 'cxml')
+    s.step()
+    assert_equals({'a': 1}, s.placed)